@@ -0,0 +1,129 @@
+import numpy as np
+
+from pulsar.CandidateGrid import CandidateGrid
+from pulsar.Solver import Solver
+from pulsar.tools import apply_backtracking, default_heuristic
+
+
+class BatchSolver:
+    """
+    Propagation of many puzzles of the same size at once, for offline solving of large puzzle sets.
+
+    The candidates of B puzzles are held as a (B, N, N) array of bitmasks (bit k set means digit k + 1 is
+    still possible). Naked singles (removing placed digits from their row, column and box) and hidden singles
+    (a digit left in one cell of a unit) run for all puzzles together with vectorized NumPy operations;
+    puzzles drop out of the working set once they stop changing. Only the puzzles propagation cannot finish
+    are handed to the search engines one by one.
+    """
+    def __init__(self, puzzles):
+        grids = np.asarray([[[val or 0 for val in row] for row in puzzle] for puzzle in puzzles], dtype=np.int64)
+        self.load(grids)
+
+    @classmethod
+    def from_array(cls, grids):
+        """ Batch from a (B, N, N) integer array of clues, 0 for empty cells """
+        solver = cls.__new__(cls)
+        solver.load(np.asarray(grids, dtype=np.int64))
+        return solver
+
+    def load(self, grids):
+        (self.count, self.size, _) = grids.shape
+        self.rank = int(self.size**0.5)
+        self.dtype = np.uint16 if self.size <= 16 else np.uint32 if self.size <= 32 else np.uint64
+
+        full_mask = (1 << self.size) - 1
+        clues = np.left_shift(1, np.maximum(grids - 1, 0)).astype(self.dtype)
+        self.masks = np.where(grids > 0, clues, full_mask).astype(self.dtype)
+        self.invalid = np.zeros(self.count, dtype=bool)
+        self.solved = np.zeros(self.count, dtype=bool)
+
+    def box_cells(self, values):
+        """ (B, N, N) cells regrouped as (B, box, cell of the box) """
+        r = self.rank
+        boxed = values.reshape(values.shape[0], r, r, r, r).transpose(0, 1, 3, 2, 4)
+        return boxed.reshape(values.shape[0], self.size, self.size)
+
+    def box_expand(self, values):
+        """ (B, box) values back onto the (B, N, N) cells of every box """
+        r = self.rank
+        return np.repeat(np.repeat(values.reshape(-1, r, r), r, axis=1), r, axis=2)
+
+    @staticmethod
+    def once_twice(units):
+        """
+        For (B, unit, cell) masks, the digits present in at least one and in at least two cells of every
+        unit, as (B, unit) masks. Bit-parallel over the digits, so no per digit arrays are needed.
+        """
+        once = np.zeros(units.shape[:2], dtype=units.dtype)
+        twice = np.zeros(units.shape[:2], dtype=units.dtype)
+        for k in range(units.shape[2]):
+            cell = units[:, :, k]
+            twice |= once & cell
+            once |= cell
+        return once, twice
+
+    def unit_counts(self, m):
+        """ once_twice of the rows, the columns and the boxes """
+        return self.once_twice(m), self.once_twice(m.transpose(0, 2, 1)), self.once_twice(self.box_cells(m))
+
+    def propagate(self):
+        """ Naked and hidden singles on the whole batch until nothing changes, sets solved and invalid """
+        full_mask = self.dtype((1 << self.size) - 1)
+        active = np.arange(self.count)
+        masks = self.masks
+
+        while active.size:
+            m = masks[active]
+            singles = (m & (m - 1)) == 0
+            values = np.where(singles, m, 0).astype(self.dtype)
+
+            # Naked singles: digits placed in a unit are removed from its other cells, a digit placed
+            # twice in a unit is a contradiction
+            ((row_placed, row_twice), (col_placed, col_twice), (box_placed, box_twice)) = self.unit_counts(values)
+            bad = (row_twice != 0).any(axis=1) | (col_twice != 0).any(axis=1) | (box_twice != 0).any(axis=1)
+            taken = row_placed[:, :, None] | col_placed[:, None, :] | self.box_expand(box_placed)
+            new = np.where(singles, m, m & ~taken)
+
+            # Hidden singles: a digit left in exactly one cell of a unit. Two such digits in one cell, a digit
+            # missing from a unit or an empty cell are contradictions
+            ((row_once, row_twice), (col_once, col_twice), (box_once, box_twice)) = self.unit_counts(new)
+            bad |= (row_once != full_mask).any(axis=1) | (col_once != full_mask).any(axis=1) | \
+                (box_once != full_mask).any(axis=1)
+            exactly = (row_once & ~row_twice)[:, :, None] | (col_once & ~col_twice)[:, None, :] | \
+                self.box_expand(box_once & ~box_twice)
+            hidden = new & exactly
+            bad |= ((hidden & (hidden - 1)) != 0).any(axis=(1, 2)) | (new == 0).any(axis=(1, 2))
+            new = np.where(hidden != 0, hidden, new)
+
+            masks[active] = new
+            changed = (new != m).any(axis=(1, 2))
+            self.invalid[active[bad]] = True
+            active = active[changed & ~bad]
+
+        self.solved = ~self.invalid & ((masks & (masks - 1)) == 0).all(axis=(1, 2))
+        return self
+
+    def stragglers(self):
+        """ Indices of the puzzles left open by propagation """
+        return np.flatnonzero(~self.solved & ~self.invalid)
+
+    def digits(self, index):
+        """ Solution (or propagated state) of one puzzle in the list-of-lists format """
+        return CandidateGrid.from_cells(self.size, self.masks[index].ravel().tolist()).to_lists()
+
+    def solve(self, heuristic=default_heuristic, budget=None):
+        """
+        Solutions of all puzzles in the list-of-lists format, None for the puzzles without one. The
+        stragglers of the vectorized propagation are finished by the custom solver and backtracking.
+        """
+        self.propagate()
+        solutions = [self.digits(k) if self.solved[k] else None for k in range(self.count)]
+
+        for k in self.stragglers():
+            solver = Solver(CandidateGrid.from_cells(self.size, self.masks[k].ravel().tolist()))
+            solver.solve()
+            if not (solver.state_solved or solver.state_invalid):
+                solver = apply_backtracking(solver.cgrid, heuristic=heuristic, budget=budget)
+            if solver.state_solved:
+                solutions[k] = solver.grid
+        return solutions
@@ -0,0 +1,130 @@
+from time import monotonic
+from threading import Thread, Event, Lock
+from multiprocessing import RawArray
+
+
+cancel_slots = 1024
+watch_interval = 0.05
+
+
+class Budget:
+    """
+    Limits of one solve request, checked cooperatively by the solvers.
+
+    deadline:  time.monotonic() value after which the search gives up, None for no deadline
+    max_nodes: branch nodes (backtracking), exact cover rows (DLX) or conflicts (SAT), None for no limit
+    flags:     shared cancel flags (CancelTable.flags) and the slot of this request, a non zero flag cancels
+    parent:    budget of the enclosing request, exceeded as well when the parent is (e.g. the engines of a race)
+
+    The flags are shared memory, so a budget handed to a child process (or rebuilt there from limits())
+    still sees cancellations from the server process.
+    """
+    def __init__(self, deadline=None, max_nodes=None, flags=None, slot=0, parent=None):
+        self.deadline = deadline
+        self.max_nodes = max_nodes
+        self.flags = flags
+        self.slot = slot
+        self.parent = parent
+
+    @classmethod
+    def from_timeout(cls, timeout=None, max_nodes=None, flags=None, slot=0):
+        return cls(None if timeout is None else monotonic() + timeout, max_nodes, flags, slot)
+
+    def limits(self):
+        """ Picklable (deadline, max_nodes, slot), the flags only travel by inheritance """
+        return self.deadline, self.max_nodes, self.slot
+
+    def cancelled(self):
+        if (self.flags is not None) and self.flags[self.slot]:
+            return True
+        return (self.parent is not None) and self.parent.cancelled()
+
+    def exceeded(self, nodes=0):
+        """ True once the request is cancelled, past its deadline or over its node budget """
+        if (self.flags is not None) and self.flags[self.slot]:
+            return True
+        if (self.max_nodes is not None) and nodes >= self.max_nodes:
+            return True
+        if (self.deadline is not None) and monotonic() >= self.deadline:
+            return True
+        return (self.parent is not None) and self.parent.exceeded(nodes)
+
+    def split(self, parts):
+        """ Budget for one of parts workers searching concurrently, the node budget is shared out """
+        max_nodes = None if self.max_nodes is None else max(1, self.max_nodes // parts)
+        parent = None if self.parent is None else self.parent.split(parts)
+        return Budget(self.deadline, max_nodes, self.flags, self.slot, parent)
+
+    def watch(self, callback):
+        """
+        Call callback from a background thread once the budget is cancelled or past its deadline, used to
+        interrupt blocking native calls. Set the returned event to stop watching.
+        """
+        done = Event()
+
+        def run():
+            while not done.wait(watch_interval):
+                if self.exceeded():
+                    callback()
+                    return
+
+        Thread(target=run, daemon=True).start()
+        return done
+
+
+class CancelTable:
+    """
+    Cancel flags of the in-flight requests, one shared memory slot per session. Must be created before the
+    solver processes are started so that they inherit the flags.
+
+    Every request is acquired and released under a request_id of its own, the table remembers the slot it
+    got. A session that was cancelled keeps its flagged slot until its cancelled requests are released,
+    requests acquired after the cancel get a new slot (the next generation of the session) with a cleared
+    flag.
+    """
+    def __init__(self, slots=cancel_slots):
+        self.flags = RawArray('b', slots)
+        self.free = list(range(slots - 1, -1, -1))
+        self.sessions = {}
+        self.requests = {}
+        self.lock = Lock()
+
+    def acquire(self, session_id, request_id):
+        """ Slot of the request (shared by the concurrent requests of its session), None when the table is full """
+        with self.lock:
+            generations = self.sessions.get(session_id)
+            if generations and not self.flags[generations[-1][0]]:
+                generation = generations[-1]
+                generation[1] += 1
+            elif self.free:
+                generation = [self.free.pop(), 1]
+                self.flags[generation[0]] = 0
+                self.sessions.setdefault(session_id, []).append(generation)
+            else:
+                return None
+            self.requests[request_id] = (session_id, generation[0])
+            return generation[0]
+
+    def release(self, request_id):
+        """ Release the slot of a request, freed once no other request holds it """
+        with self.lock:
+            if request_id not in self.requests:
+                return
+            (session_id, slot) = self.requests.pop(request_id)
+            generations = self.sessions[session_id]
+            generation = next(generation for generation in generations if generation[0] == slot)
+            generation[1] -= 1
+            if generation[1] == 0:
+                generations.remove(generation)
+                self.free.append(slot)
+            if not generations:
+                del self.sessions[session_id]
+
+    def cancel(self, session_id):
+        """ Ask every running request of the session to stop, returns False if it has none """
+        with self.lock:
+            if session_id not in self.sessions:
+                return False
+            for slot, _ in self.sessions[session_id]:
+                self.flags[slot] = 1
+            return True
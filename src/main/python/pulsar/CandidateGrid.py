@@ -0,0 +1,139 @@
+from pulsar.Topology import get_topology
+
+
+class CandidateGrid:
+    """
+    Compact candidate grid used by the solvers.
+
+    Every cell holds an integer bitmask of its remaining candidates (bit k set means digit k + 1
+    is still possible), stored row-major in a flat list. Units are numbered as in Topology (rows,
+    then columns, then boxes); for every unit the "placed" mask tracks the digits already fixed
+    in it, and counts[unit * size + k] is the number of its cells still holding digit k + 1. conflict is
+    the index of a cell whose digit was already placed in one of its units when loading, None otherwise.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.rank = int(size**0.5)
+        self.full_mask = (1 << size) - 1
+        self.topology = get_topology(size)
+
+        self.cells = [self.full_mask] * (size * size)
+        self.placed = [0] * (3 * size)
+        self.counts = [size] * (3 * size * size)
+        self.conflict = None
+
+    @classmethod
+    def from_lists(cls, grid):
+        """ Build a candidate grid from the list-of-lists format, single candidates count as placed """
+        cgrid = cls(len(grid))
+        cells = cgrid.cells
+        idx = 0
+        for i in range(cgrid.size):
+            for j in range(cgrid.size):
+                mask = digits_to_mask(grid[i][j])
+                cells[idx] = mask
+                if len(grid[i][j]) == 1 and not cgrid.mark_placed(i, j, mask) and cgrid.conflict is None:
+                    cgrid.conflict = idx
+                idx += 1
+        cgrid.recount()
+        return cgrid
+
+    @classmethod
+    def from_cells(cls, size, cells):
+        """
+        Build a candidate grid from a flat list of masks (e.g. a GridSlab slot). Nothing counts as placed,
+        Solver.solve places the single candidates and propagates them
+        """
+        cgrid = cls(size)
+        cgrid.cells = list(cells)
+        cgrid.recount()
+        return cgrid
+
+    def to_lists(self):
+        """ Convert back to the list-of-lists format used at the API boundary """
+        size = self.size
+        cells = self.cells
+        return [[mask_to_digits(cells[i * size + j]) for j in range(size)] for i in range(size)]
+
+    def copy(self):
+        cgrid = CandidateGrid.__new__(CandidateGrid)
+        cgrid.size = self.size
+        cgrid.rank = self.rank
+        cgrid.full_mask = self.full_mask
+        cgrid.topology = self.topology
+        cgrid.cells = self.cells[:]
+        cgrid.placed = self.placed[:]
+        cgrid.counts = self.counts[:]
+        cgrid.conflict = self.conflict
+        return cgrid
+
+    def recount(self):
+        """ Rebuild the per-unit digit counts from the cell masks """
+        size = self.size
+        cells = self.cells
+        counts = [0] * (3 * size * size)
+        for unit, unit_cells in enumerate(self.topology.units):
+            base = unit * size
+            for idx in unit_cells:
+                mask = cells[idx]
+                while mask:
+                    bit = mask & -mask
+                    mask ^= bit
+                    counts[base + bit.bit_length() - 1] += 1
+        self.counts = counts
+
+    @property
+    def row_placed(self):
+        return self.placed[:self.size]
+
+    @property
+    def col_placed(self):
+        return self.placed[self.size:2 * self.size]
+
+    @property
+    def box_placed(self):
+        return self.placed[2 * self.size:]
+
+    def box_of(self, i, j):
+        return self.topology.box_of[i * self.size + j]
+
+    def is_placed(self, i, j, bit):
+        (u1, u2, u3) = self.topology.cell_units[i * self.size + j]
+        return bool(bit & (self.placed[u1] | self.placed[u2] | self.placed[u3]))
+
+    def mark_placed(self, i, j, bit):
+        """ Place a digit in the units of a cell, False if it was already placed in one of them """
+        fresh = True
+        for unit in self.topology.cell_units[i * self.size + j]:
+            if self.placed[unit] & bit:
+                fresh = False
+            self.placed[unit] |= bit
+        return fresh
+
+    def is_solved(self):
+        for mask in self.cells:
+            if mask & (mask - 1):
+                return False
+        return True
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def mask_to_digits(mask):
+    digits = []
+    val = 1
+    while mask:
+        if mask & 1:
+            digits.append(val)
+        mask >>= 1
+        val += 1
+    return digits
+
+
+def digits_to_mask(digits):
+    mask = 0
+    for val in digits:
+        mask |= 1 << (val - 1)
+    return mask
@@ -0,0 +1,133 @@
+from itertools import islice, permutations, product
+
+
+# Upper bound on the row and column arrangements compared per orientation, only reached by very symmetric
+# clue patterns
+canonical_candidates_max = 64
+
+
+class Transform:
+    """
+    Sudoku symmetry mapping a puzzle to its canonical form: optional transpose, then rows and columns
+    reordered (row_order[i] is the puzzle row placed at row i, bands and stacks stay intact) and the
+    digits relabelled (digit_map[d] is the canonical digit of puzzle digit d).
+    """
+    def __init__(self, size, transpose, row_order, col_order, digit_map):
+        self.size = size
+        self.transpose = transpose
+        self.row_order = row_order
+        self.col_order = col_order
+        self.digit_map = digit_map
+
+    def apply(self, puzzle):
+        """ Canonical grid of the puzzle (None for empty cells) """
+        grid = transposed(puzzle) if self.transpose else puzzle
+        return [[self.digit_map[grid[r][c]] if grid[r][c] else None for c in self.col_order]
+                for r in self.row_order]
+
+    def restore(self, solution):
+        """ Map a solution of the canonical grid (list-of-lists format) back onto the original puzzle """
+        inverse = {canonical: digit for digit, canonical in self.digit_map.items()}
+        grid = [[None] * self.size for _ in range(self.size)]
+        for i, r in enumerate(self.row_order):
+            for j, c in enumerate(self.col_order):
+                grid[r][c] = [inverse[val] for val in solution[i][j]]
+        return transposed(grid) if self.transpose else grid
+
+
+def canonicalize(puzzle):
+    """
+    Canonical form of a puzzle under the sudoku symmetries (digit relabelling, row and column permutations
+    within bands and stacks, band and stack permutations, transpose) and the transform leading there.
+
+    The key is the flat tuple of canonical digits (0 for empty cells). Lines are first ordered by invariants
+    of the clue pattern, only arrangements tied on those invariants are compared lexicographically (up to
+    canonical_candidates_max per orientation). Two puzzles with the same key are always equivalent; for
+    very symmetric patterns an equivalent puzzle may occasionally get a different key.
+    """
+    size = len(puzzle)
+    rank = int(size**0.5)
+
+    best_key, best_transform = None, None
+    for transpose in (False, True):
+        grid = transposed(puzzle) if transpose else puzzle
+        row_orders = list(islice(line_orders(grid, rank), canonical_candidates_max))
+        col_limit = max(1, canonical_candidates_max // len(row_orders))
+        col_orders = list(islice(line_orders(transposed(grid), rank), col_limit))
+
+        for row_order in row_orders:
+            for col_order in col_orders:
+                key, digit_map = relabel(grid, row_order, col_order, size)
+                if best_key is None or key < best_key:
+                    best_key = key
+                    best_transform = Transform(size, transpose, row_order, col_order, digit_map)
+
+    return best_key, best_transform
+
+
+def line_orders(grid, rank):
+    """ Band preserving row orders of the grid, sorted by clue pattern invariants, ties enumerated """
+    size = len(grid)
+    row_counts = [sum(1 for val in row if val) for row in grid]
+    col_counts = [sum(1 for i in range(size) if grid[i][j]) for j in range(size)]
+
+    # A row is described by its clue count and the clue counts of the columns it has clues in
+    signature = [(row_counts[r], tuple(sorted((col_counts[c] for c in range(size) if grid[r][c]),
+                                              reverse=True)))
+                 for r in range(size)]
+
+    bands = []
+    for band in range(rank):
+        rows = sorted(range(band * rank, (band + 1) * rank), key=lambda r: signature[r], reverse=True)
+        bands.append((tuple(signature[r] for r in rows), rows))
+    bands.sort(key=lambda band: band[0], reverse=True)
+
+    # Every group of equal signatures (bands, and rows within a band) can be arranged in any order
+    band_groups = tie_groups([band_signature for (band_signature, _) in bands])
+    row_groups = [tie_groups(band_signature) for (band_signature, _) in bands]
+    choices = [list(permutations(group)) for group in band_groups]
+    choices += [list(permutations(group)) for groups in row_groups for group in groups]
+
+    for picks in product(*choices):
+        band_order = [b for group in picks[:len(band_groups)] for b in group]
+        row_picks = iter(picks[len(band_groups):])
+        band_rows = [[rows[k] for _ in row_groups[b] for k in next(row_picks)]
+                     for b, (_, rows) in enumerate(bands)]
+        yield [r for b in band_order for r in band_rows[b]]
+
+
+def tie_groups(keys):
+    """ Index groups of consecutive equal keys """
+    groups = []
+    for k, key in enumerate(keys):
+        if groups and keys[groups[-1][0]] == key:
+            groups[-1].append(k)
+        else:
+            groups.append([k])
+    return groups
+
+
+def relabel(grid, row_order, col_order, size):
+    """ Flat key of the arrangement with the digits numbered by first appearance, and the digit map """
+    digit_map = {}
+    key = []
+    for r in row_order:
+        row = grid[r]
+        for c in col_order:
+            val = row[c]
+            if val:
+                if val not in digit_map:
+                    digit_map[val] = len(digit_map) + 1
+                key.append(digit_map[val])
+            else:
+                key.append(0)
+
+    # Digits without clues take the remaining labels in order
+    for val in range(1, size + 1):
+        if val not in digit_map:
+            digit_map[val] = len(digit_map) + 1
+    return tuple(key), digit_map
+
+
+def transposed(grid):
+    return [list(col) for col in zip(*grid)]
@@ -0,0 +1,249 @@
+class DLXSolver:
+    """
+    Exact cover solver (Knuth's Algorithm X with dancing links).
+
+    The four constraint families (cell, row-digit, column-digit, box-digit) are the columns and every
+    candidate placement is a row of four nodes. Links are kept in flat integer arrays instead of node
+    objects; node 0 is the root header and nodes 1..4N^2 are the column headers. Constraints already
+    satisfied by the givens are left out, so the search only runs over the empty cells.
+
+    An optional CandidateGrid (e.g. after Solver propagation, which keeps every solution) restricts the
+    rows to the remaining candidates, which matters a lot on 16x16 and larger grids. An optional Budget
+    stops the search (state_cancelled) once exceeded, counting the selected rows as nodes.
+    """
+    def __init__(self, puzzle, cgrid=None, budget=None):
+        self.size = len(puzzle)
+        self.rank = int(self.size**0.5)
+        self.puzzle = puzzle
+        self.cgrid = cgrid
+
+        self.budget = budget
+        self.state_invalid = False
+        self.state_cancelled = False
+        self.nodes_explored = 0
+        self.max_depth = 0
+        self.backtracks = 0
+
+        self.build()
+
+    def constraints(self, i, j, d):
+        size = self.size
+        box = (i // self.rank) * self.rank + (j // self.rank)
+        cells = size * size
+        return (1 + i * size + j,
+                1 + cells + i * size + d,
+                1 + 2 * cells + j * size + d,
+                1 + 3 * cells + box * size + d)
+
+    def build(self):
+        size = self.size
+        column_count = 4 * size * size
+
+        if self.cgrid is not None:
+            # Cells narrowed down to a single candidate are treated like givens
+            cells = self.cgrid.cells
+            self.puzzle = [[self.puzzle[i][j] or (cells[i * size + j].bit_length()
+                                                  if not cells[i * size + j] & (cells[i * size + j] - 1) else None)
+                            for j in range(size)] for i in range(size)]
+
+        satisfied = [False] * (column_count + 1)
+        for i in range(size):
+            for j in range(size):
+                if self.puzzle[i][j]:
+                    for col in self.constraints(i, j, self.puzzle[i][j] - 1):
+                        if satisfied[col]:
+                            self.state_invalid = True
+                        satisfied[col] = True
+
+        # Headers: root (0) and one per column, only the open columns are linked into the root list
+        self.L = list(range(-1, column_count))
+        self.R = list(range(1, column_count + 2))
+        self.U = list(range(column_count + 1))
+        self.D = list(range(column_count + 1))
+        self.C = list(range(column_count + 1))
+        self.S = [0] * (column_count + 1)
+        self.row_of = [-1] * (column_count + 1)
+        self.rows = []
+
+        last = 0
+        for col in range(1, column_count + 1):
+            if not satisfied[col]:
+                self.R[last] = col
+                self.L[col] = last
+                last = col
+        self.R[last] = 0
+        self.L[0] = last
+
+        for i in range(size):
+            for j in range(size):
+                if self.puzzle[i][j]:
+                    continue
+                for d in range(size):
+                    if (self.cgrid is not None) and not (self.cgrid.cells[i * size + j] >> d) & 1:
+                        continue
+                    cols = self.constraints(i, j, d)
+                    if any(satisfied[col] for col in cols):
+                        continue
+                    self.add_row((i, j, d), cols)
+
+    def add_row(self, placement, cols):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        row_id = len(self.rows)
+        self.rows.append(placement)
+
+        first = len(L)
+        for k, col in enumerate(cols):
+            node = first + k
+            L.append(first + (k - 1) % len(cols))
+            R.append(first + (k + 1) % len(cols))
+            U.append(U[col])
+            D.append(col)
+            C.append(col)
+            self.row_of.append(row_id)
+            D[U[col]] = node
+            U[col] = node
+            S[col] += 1
+
+    def search(self):
+        """ Generator over exact covers, each one yielded as the list of chosen row ids """
+        if self.state_invalid:
+            return
+
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        budget = self.budget
+
+        def cover(col):
+            R[L[col]] = R[col]
+            L[R[col]] = L[col]
+            i = D[col]
+            while i != col:
+                j = R[i]
+                while j != i:
+                    D[U[j]] = D[j]
+                    U[D[j]] = U[j]
+                    S[C[j]] -= 1
+                    j = R[j]
+                i = D[i]
+
+        def uncover(col):
+            i = U[col]
+            while i != col:
+                j = L[i]
+                while j != i:
+                    S[C[j]] += 1
+                    D[U[j]] = j
+                    U[D[j]] = j
+                    j = L[j]
+                i = U[i]
+            R[L[col]] = col
+            L[R[col]] = col
+
+        def choose():
+            best, best_size = 0, -1
+            col = R[0]
+            while col != 0:
+                if best_size < 0 or S[col] < best_size:
+                    best, best_size = col, S[col]
+                    if best_size <= 1:
+                        break
+                col = R[col]
+            return best
+
+        def unselect(row):
+            j = L[row]
+            while j != row:
+                uncover(C[j])
+                j = L[j]
+
+        if R[0] == 0:
+            yield []
+            return
+
+        # The column of the current level is covered but owned by no row on the stack yet, pending keeps it
+        # so that an early stop can uncover it before the stack is unwound
+        stack = []
+        pending = None
+        try:
+            c = choose()
+            cover(c)
+            pending = c
+            r = D[c]
+            while True:
+                if r != c:
+                    if (budget is not None) and budget.exceeded(self.nodes_explored):
+                        self.state_cancelled = True
+                        return
+                    self.nodes_explored += 1
+                    j = R[r]
+                    while j != r:
+                        cover(C[j])
+                        j = R[j]
+                    stack.append(r)
+                    pending = None
+                    if len(stack) > self.max_depth:
+                        self.max_depth = len(stack)
+
+                    if R[0] == 0:
+                        yield [self.row_of[node] for node in stack]
+                        unselect(stack.pop())
+                        pending = c
+                        r = D[r]
+                        continue
+
+                    c = choose()
+                    cover(c)
+                    pending = c
+                    r = D[c]
+                    continue
+
+                # Column exhausted, backtrack to the previous level
+                uncover(c)
+                pending = None
+                if not stack:
+                    return
+                self.backtracks += 1
+                r = stack.pop()
+                unselect(r)
+                c = C[r]
+                pending = c
+                r = D[r]
+        finally:
+            # Restore the links when the caller stops early or the budget ran out
+            if pending is not None:
+                uncover(pending)
+            while stack:
+                r = stack.pop()
+                unselect(r)
+                uncover(C[r])
+
+    def to_solution(self, row_ids):
+        solution = [[[self.puzzle[i][j]] if self.puzzle[i][j] else [] for j in range(self.size)]
+                    for i in range(self.size)]
+        for row_id in row_ids:
+            (i, j, d) = self.rows[row_id]
+            solution[i][j] = [d + 1]
+        return solution
+
+    def solve(self):
+        """ First solution in the list-of-lists format, None if the puzzle has no solution (or the budget ran out) """
+        for row_ids in self.search():
+            return self.to_solution(row_ids)
+        return None
+
+    def count_solutions(self, limit=None):
+        """ Number of solutions, stopping as soon as limit is reached """
+        count = 0
+        for _ in self.search():
+            count += 1
+            if limit is not None and count >= limit:
+                break
+        return count
+
+    def enumerate_solutions(self, limit=None):
+        """ Generator over all solutions (up to limit) in the list-of-lists format """
+        count = 0
+        for row_ids in self.search():
+            yield self.to_solution(row_ids)
+            count += 1
+            if limit is not None and count >= limit:
+                return
@@ -0,0 +1,206 @@
+from random import Random
+from multiprocessing import Pool, cpu_count
+
+from pulsar.CandidateGrid import CandidateGrid
+from pulsar.Solver import Solver
+from pulsar.SATSolver import get_warm_solver
+from pulsar.heuristics import Branching
+from pulsar.tools import backtrack, count_solutions, simple_solve
+
+
+# Full grids and digs tried for one puzzle before giving up on its targets
+generator_attempts = 20
+# Branch nodes of one attempt at filling a grid, a stuck fill restarts from new random boxes
+generator_fill_nodes = 2000
+generator_chunksize = 8
+
+# Hardest technique needed by the logical solver, 'expert' puzzles need search
+difficulty_levels = ('easy', 'medium', 'hard', 'expert')
+technique_levels = {
+    'naked_single': 'easy',
+    'hidden_single': 'easy',
+    'locked_candidates': 'medium',
+    'naked_pairs': 'medium',
+    'hidden_pairs': 'medium',
+}
+
+# Cells cleared together, as maps of a cell (i, j) of an N x N grid to its images
+symmetries = {
+    'none': lambda i, j, n: [(i, j)],
+    'rotational': lambda i, j, n: [(i, j), (n - 1 - i, n - 1 - j)],
+    'diagonal': lambda i, j, n: [(i, j), (j, i)],
+    'mirror': lambda i, j, n: [(i, j), (i, n - 1 - j)],
+    'dihedral': lambda i, j, n: [(i, j), (j, i), (n - 1 - i, n - 1 - j), (n - 1 - j, n - 1 - i),
+                                 (i, n - 1 - j), (n - 1 - j, i), (n - 1 - i, j), (j, n - 1 - i)],
+}
+
+
+def full_grid(size, rng):
+    """ Random complete grid: the diagonal boxes (which share no unit) are shuffled, search fills the rest """
+    rank = int(size**0.5)
+    branching = Branching(cell_order='mrv', value_order='random', restarts=1, seed=rng.random())
+
+    while True:
+        actions = []
+        for box in range(rank):
+            for k, val in enumerate(rng.sample(range(1, size + 1), size)):
+                actions.append({'idx': (box * rank + k // rank, box * rank + k % rank), 'val': val})
+
+        solver = Solver(CandidateGrid(size), actions, strategies=[])
+        solver.solve()
+        if not solver.state_solved:
+            solver.enable_trail()
+            backtrack(solver, 1, branching, generator_fill_nodes)
+        if solver.state_solved:
+            return [[cell[0] for cell in row] for row in solver.grid]
+
+
+def cell_orbits(size, symmetry='none'):
+    """ Groups of cells cleared together to keep the clue pattern symmetric """
+    images = symmetries[symmetry]
+    orbits = {tuple(sorted(set(images(i, j, size)))) for i in range(size) for j in range(size)}
+    return sorted(orbits)
+
+
+def is_unique(puzzle, solution, engine='SAT'):
+    """ True if solution is the only solution of puzzle, see uniqueness_check """
+    return uniqueness_check(solution, engine)(puzzle)
+
+
+def uniqueness_check(solution, engine='SAT'):
+    """
+    Function telling whether a puzzle (solution with some cells cleared) still has solution as its only
+    solution. With 'SAT' the warm solver of the size looks for a solution differing from the known one in
+    a cleared cell, with the clues as assumptions, so the learnt clauses carry over from one check to the
+    next. Any other engine name counts up to two solutions with that engine.
+    """
+    if engine != 'SAT':
+        return lambda puzzle: count_solutions(puzzle, 2, engine)['count'] == 1
+
+    size = len(solution)
+    solver = get_warm_solver(solution)
+    solver.budget = None
+    literals = [solver.var(i, j, solution[i][j] - 1) for i in range(size) for j in range(size)]
+
+    def check(puzzle):
+        assumptions, blocking = [], []
+        for lit, val in zip(literals, (val for row in puzzle for val in row)):
+            if val:
+                assumptions.append(lit)
+            else:
+                blocking.append(-lit)
+
+        # The blocking clause is retired through its activation literal, as in SATSolver.check_next_solution
+        activation = solver.new_var()
+        solver.sudoku.add_clause([-activation] + blocking)
+        unique = not solver.run(assumptions + [activation])
+        solver.sudoku.add_clause([-activation])
+        return unique
+
+    return check
+
+
+def dig(solution, clues=None, symmetry='none', rng=None, engine='SAT'):
+    """
+    Clear the cells of a complete grid in random order (an orbit of the symmetry at a time), keeping every
+    removal after which the solution is still unique. Stops once no more than clues are left, otherwise at
+    a minimal puzzle. Empty cells are None.
+    """
+    rng = rng or Random()
+    size = len(solution)
+    puzzle = [row[:] for row in solution]
+    left = size * size
+    target = clues or 0
+
+    unique = uniqueness_check(solution, engine)
+    orbits = cell_orbits(size, symmetry)
+    rng.shuffle(orbits)
+    for orbit in orbits:
+        if left <= target:
+            break
+        if left - len(orbit) < target:
+            continue
+
+        for (i, j) in orbit:
+            puzzle[i][j] = None
+        if unique(puzzle):
+            left -= len(orbit)
+        else:
+            for (i, j) in orbit:
+                puzzle[i][j] = solution[i][j]
+
+    return puzzle
+
+
+def grade(puzzle):
+    """ Difficulty level of a puzzle and the techniques the logical solver used on it """
+    solver = simple_solve(puzzle)
+    if not solver.state_solved:
+        return 'expert', solver.technique_hits
+
+    level = 'easy'
+    for technique in solver.technique_hits:
+        technique_level = technique_levels.get(technique, 'hard')
+        if difficulty_levels.index(technique_level) > difficulty_levels.index(level):
+            level = technique_level
+    return level, solver.technique_hits
+
+
+def generate(size=9, clues=None, symmetry='none', difficulty=None, seed=None, engine='SAT',
+             attempts=generator_attempts):
+    """
+    One puzzle with a unique solution, at most clues givens, the clue pattern invariant under symmetry and
+    a difficulty level in difficulty (a level name or a list of them, None for any). Returns
+    {'puzzle', 'solution', 'clues', 'level', 'techniques'} or None when no attempt met the targets.
+    """
+    rng = Random(seed)
+    levels = [difficulty] if isinstance(difficulty, str) else difficulty
+
+    for _ in range(attempts):
+        solution = full_grid(size, rng)
+        puzzle = dig(solution, clues, symmetry, rng, engine)
+        count = sum(1 for row in puzzle for val in row if val)
+        if (clues is not None) and count > clues:
+            continue
+
+        level, techniques = grade(puzzle)
+        if (levels is not None) and level not in levels:
+            continue
+        return {'puzzle': puzzle, 'solution': solution, 'clues': count, 'level': level, 'techniques': techniques}
+
+    return None
+
+
+def generate_job(job):
+    (size, clues, symmetry, difficulty, seed, engine) = job
+    return generate(size, clues, symmetry, difficulty, seed, engine)
+
+
+def generate_puzzles(count, size=9, clues=None, symmetry='none', difficulty=None, seed=None, engine='SAT',
+                     processes=None, chunksize=generator_chunksize):
+    """
+    Generator streaming count puzzles (see generate) in completion order, built on a pool of processes
+    (cpu_count() by default, 1 generates in this process). With a seed the set of puzzles is reproducible.
+    Stops early when a whole round of jobs fails to meet the targets.
+    """
+    processes = processes or cpu_count()
+    rng = Random(seed)
+    pool = Pool(processes) if processes > 1 else None
+
+    try:
+        produced = 0
+        while produced < count:
+            jobs = [(size, clues, symmetry, difficulty, rng.getrandbits(64), engine) for _ in range(count - produced)]
+            results = pool.imap_unordered(generate_job, jobs, chunksize=chunksize) if pool else map(generate_job, jobs)
+
+            round_produced = 0
+            for result in results:
+                if result is not None:
+                    round_produced += 1
+                    yield result
+            if not round_produced:
+                return
+            produced += round_produced
+    finally:
+        if pool is not None:
+            pool.terminate()
@@ -0,0 +1,45 @@
+import os
+from array import array
+from multiprocessing import shared_memory
+
+
+class GridSlab:
+    """
+    Fixed number of grid states packed in one shared memory block, so processes exchange grids by slot index.
+
+    Every slot holds the size * size candidate masks of a CandidateGrid as unsigned integers (32 bit up to
+    32x32 grids, 64 bit above). The slab travels to child processes by name, a pickled slab attaches to the
+    existing block instead of copying it. Only the creating process unlinks the block.
+    """
+    def __init__(self, size, slots, name=None):
+        self.size = size
+        self.slots = slots
+        self.slot_len = size * size
+        self.typecode = 'I' if size <= 32 else 'Q'
+        self.owner_pid = os.getpid() if name is None else None
+
+        itemsize = array(self.typecode).itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_len * itemsize)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.view = self.shm.buf.cast(self.typecode)
+
+    def __reduce__(self):
+        return GridSlab, (self.size, self.slots, self.shm.name)
+
+    def write(self, slot, cells):
+        start = slot * self.slot_len
+        self.view[start:start + self.slot_len] = array(self.typecode, cells)
+
+    def read(self, slot):
+        start = slot * self.slot_len
+        return self.view[start:start + self.slot_len].tolist()
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+            self.shm.close()
+            if self.owner_pid == os.getpid():
+                self.shm.unlink()
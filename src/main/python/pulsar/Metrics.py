@@ -0,0 +1,168 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+
+# Upper bounds of the histogram buckets, +Inf is implied
+duration_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+depth_buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+metric_help = {
+    'pulsar_solves_total': ('counter', "Solver results by engine and outcome"),
+    'pulsar_propagations_total': ('counter', "Singles assigned by propagation"),
+    'pulsar_branch_nodes_total': ('counter', "Search decisions (backtracking branches, DLX rows)"),
+    'pulsar_backtracks_total': ('counter', "Search branches rolled back"),
+    'pulsar_sat_conflicts_total': ('counter', "Conflicts of the SAT solver"),
+    'pulsar_sat_decisions_total': ('counter', "Decisions of the SAT solver"),
+    'pulsar_technique_hits_total': ('counter', "Deductions by technique"),
+    'pulsar_cache_hits_total': ('counter', "Puzzles answered from the solution cache"),
+    'pulsar_cache_misses_total': ('counter', "Puzzles not found in the solution cache"),
+    'pulsar_solve_duration_seconds': ('histogram', "Wall time of a solve by engine"),
+    'pulsar_phase_duration_seconds': ('histogram', "Time spent per solver phase"),
+    'pulsar_search_depth': ('histogram', "Deepest search level reached per solve"),
+}
+
+
+class SearchStats:
+    """
+    Statistics of one solve, filled in the same way by every engine and sent as the 'stats' field of the
+    payload. Counters an engine does not have stay at 0.
+
+    propagations:          singles assigned by propagation (naked and hidden)
+    branch_nodes:          search decisions (backtracking branches, DLX rows)
+    max_depth:             deepest search level reached
+    backtracks:            branches rolled back
+    conflicts, decisions:  SAT solver counters
+    techniques:            hits of every deduction technique
+    phases:                seconds spent per phase ('propagation', 'encoding', 'search')
+    """
+    counters = ('propagations', 'branch_nodes', 'max_depth', 'backtracks', 'conflicts', 'decisions')
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.values = dict.fromkeys(self.counters, 0)
+        self.techniques = {}
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + perf_counter() - start
+
+    def add_solver(self, solver):
+        """ Counters of a Solver (propagation and trail based search) """
+        hits = solver.technique_hits
+        self.values['propagations'] += hits.get('naked_single', 0) + hits.get('hidden_single', 0)
+        self.values['branch_nodes'] += solver.branch_nodes
+        self.values['backtracks'] += solver.backtracks
+        self.values['max_depth'] = max(self.values['max_depth'], solver.max_depth)
+        for technique, count in hits.items():
+            self.techniques[technique] = self.techniques.get(technique, 0) + count
+
+    def add_sat(self, solver):
+        """ Counters of the last solve of a SATSolver """
+        self.values['conflicts'] += solver.conflicts
+        self.values['decisions'] += solver.decisions
+
+    def add_dlx(self, solver):
+        self.values['branch_nodes'] += solver.nodes_explored
+        self.values['backtracks'] += solver.backtracks
+        self.values['max_depth'] = max(self.values['max_depth'], solver.max_depth)
+
+    def add(self, stats):
+        """ Merge a to_dict() of other stats, e.g. reported by a worker process """
+        for key in self.counters:
+            if key == 'max_depth':
+                self.values[key] = max(self.values[key], stats[key])
+            else:
+                self.values[key] += stats[key]
+        for technique, count in stats['techniques'].items():
+            self.techniques[technique] = self.techniques.get(technique, 0) + count
+        for name, seconds in stats['phases'].items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def to_dict(self):
+        return dict(self.values, engine=self.engine, techniques=dict(self.techniques),
+                    phases={name: round(seconds, 6) for name, seconds in self.phases.items()})
+
+
+class MetricsRegistry:
+    """ Counters and histograms of the solver results, rendered in the Prometheus text format """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=duration_buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = (buckets, [0] * (len(buckets) + 1), [0.0])
+            (_, counts, total) = self.histograms[key]
+            counts[bisect_left(buckets, value)] += 1
+            total[0] += value
+
+    def record(self, payload):
+        """ Count one solver payload, payloads without stats (e.g. cache hits) are skipped """
+        stats = payload.get('stats')
+        if not stats:
+            return
+
+        engine = payload.get('engine') or stats['engine'] or 'unknown'
+        outcome = 'solved' if payload.get('solution') is not None else 'unsolved'
+        self.inc('pulsar_solves_total', engine=engine, outcome=outcome)
+        self.inc('pulsar_propagations_total', stats['propagations'], engine=engine)
+        self.inc('pulsar_branch_nodes_total', stats['branch_nodes'], engine=engine)
+        self.inc('pulsar_backtracks_total', stats['backtracks'], engine=engine)
+        self.inc('pulsar_sat_conflicts_total', stats['conflicts'], engine=engine)
+        self.inc('pulsar_sat_decisions_total', stats['decisions'], engine=engine)
+        for technique, count in stats['techniques'].items():
+            self.inc('pulsar_technique_hits_total', count, technique=technique)
+
+        self.observe('pulsar_solve_duration_seconds', payload.get('duration', 0.0), engine=engine)
+        self.observe('pulsar_search_depth', stats['max_depth'], depth_buckets, engine=engine)
+        for name, seconds in stats['phases'].items():
+            self.observe('pulsar_phase_duration_seconds', seconds, phase=name)
+
+    def render(self, extra_counters=None):
+        """ Prometheus text exposition, extra_counters adds {name: value} counters kept elsewhere """
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (buckets, list(counts), total[0])
+                          for key, (buckets, counts, total) in self.histograms.items()}
+        for name, value in (extra_counters or {}).items():
+            counters[(name, ())] = value
+
+        for name in sorted({name for (name, _) in counters} | {name for (name, _) in histograms}):
+            (kind, text) = metric_help.get(name, ('counter', name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for (key_name, labels), (buckets, counts, total) in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
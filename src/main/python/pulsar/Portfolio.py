@@ -0,0 +1,62 @@
+from threading import Lock
+
+from pulsar.CandidateGrid import popcount
+
+
+# Difficulty score (candidates left beyond one per unsolved cell, after propagation) up to which the auto
+# mode finishes with backtracking alone, above it backtracking races SAT. Other sizes start at size^2
+portfolio_thresholds = {9: 200.0, 16: 400.0, 25: 800.0}
+portfolio_rate = 0.2
+portfolio_slow_seconds = 1.0
+
+
+class Portfolio:
+    """
+    Engine selection of the 'auto' solver mode.
+
+    After propagation a puzzle is scored by the candidates left on its unsolved cells (empties times
+    candidate density). Easy puzzles (score up to the threshold of their size) are finished by backtracking,
+    harder ones race backtracking against SAT. The thresholds adapt to the outcomes recorded from the
+    payloads: backtracking winning a race raises the threshold towards that score, a backtracking-only solve
+    slower than slow_seconds lowers it.
+    """
+    def __init__(self, thresholds=None, rate=portfolio_rate, slow_seconds=portfolio_slow_seconds):
+        self.thresholds = dict(portfolio_thresholds if thresholds is None else thresholds)
+        self.rate = rate
+        self.slow_seconds = slow_seconds
+        self.wins = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def difficulty(cgrid):
+        return sum(popcount(mask) - 1 for mask in cgrid.cells if mask & (mask - 1))
+
+    def threshold(self, size):
+        return self.thresholds.get(size, float(size * size))
+
+    def choose(self, size, score):
+        """ 'backtracking' or 'race' """
+        return 'backtracking' if score <= self.threshold(size) else 'race'
+
+    def record(self, payload):
+        """ Learn from the payload of an auto mode solve """
+        auto = payload.get('auto')
+        engine = payload.get('engine')
+        if (not auto) or engine in (None, 'propagation'):
+            return
+
+        size, score, plan = auto['size'], auto['score'], auto['plan']
+        with self.lock:
+            wins = self.wins.setdefault(size, {})
+            wins[engine] = wins.get(engine, 0) + 1
+
+            threshold = self.threshold(size)
+            if plan == 'race' and engine == 'backtracking':
+                threshold += self.rate * (score - threshold)
+            elif plan == 'backtracking' and payload['duration'] > self.slow_seconds:
+                threshold -= self.rate * (threshold - score / 2)
+            self.thresholds[size] = threshold
+
+    def stats(self):
+        with self.lock:
+            return {'thresholds': dict(self.thresholds), 'wins': {size: dict(w) for size, w in self.wins.items()}}
@@ -0,0 +1,98 @@
+import cProfile
+import logging
+import os
+import pstats
+import tempfile
+import uuid
+from queue import SimpleQueue as LocalQueue
+
+
+logger = logging.getLogger(__name__)
+
+# Where the pstats dumps of profiled requests are stored, None only returns the summary. Only the newest
+# profile_keep dumps are kept, older ones are deleted as new ones are written
+profile_dir = os.path.join(tempfile.gettempdir(), 'pulsar-profiles')
+profile_keep = 32
+# Functions listed in the summary, by own time
+profile_top = 15
+# Functions always summarized when they were called, by name
+profile_functions = ('setval', 'assign', 'eliminate', 'propagate', 'apply_branch', 'undo', 'getrelative_cells',
+                     'deepcopy')
+
+
+def profile_solver(target, puzzle, response_queue, session_id, *args):
+    """
+    Run a solver function (puzzle, response_queue, session_id, *args as tools.run_solver) under cProfile and
+    put its payload on response_queue with a 'profile' report (see profile_report). Only this process is
+    profiled, the worker processes of the parallel solver and of an 'auto' race are not.
+    """
+    results = LocalQueue()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        target(puzzle, results, session_id, *args)
+    finally:
+        profiler.disable()
+
+    payload = results.get()
+    payload['profile'] = profile_report(profiler)
+    try:
+        response_queue.put(payload)
+    except ValueError:
+        logger.error("Error occurred while loading response queue")
+
+
+def profile_report(profiler):
+    """
+    Summary of a profile: {'total': seconds, 'calls', 'top': the profile_top functions by own time,
+    'functions': calls, own and cumulative seconds of the profile_functions that were called, 'file': the
+    pstats dump (None without profile_dir)}. The dump opens with pstats, snakeviz or flameprof.
+    """
+    stats = pstats.Stats(profiler)
+
+    top, functions = [], {}
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+        top.append({'function': f"{os.path.basename(filename)}:{line}({name})", 'calls': calls,
+                    'own': own, 'cumulative': cumulative})
+        short = name.rsplit('.', 1)[-1].strip('<>')
+        if short in profile_functions:
+            entry = functions.setdefault(short, {'calls': 0, 'own': 0.0, 'cumulative': 0.0})
+            entry['calls'] += calls
+            entry['own'] += own
+            entry['cumulative'] += cumulative
+
+    top.sort(key=lambda entry: entry['own'], reverse=True)
+    for entry in top[:profile_top] + list(functions.values()):
+        entry['own'] = round(entry['own'], 6)
+        entry['cumulative'] = round(entry['cumulative'], 6)
+
+    path = None
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f'{uuid.uuid4().hex}.pstats')
+        stats.dump_stats(path)
+        prune_dumps(profile_dir, profile_keep)
+
+    return {'total': round(stats.total_tt, 6),
+            'calls': stats.total_calls,
+            'top': top[:profile_top],
+            'functions': functions,
+            'file': path}
+
+
+def prune_dumps(directory, keep):
+    """ Delete all but the keep newest pstats dumps of directory """
+    dumps = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.pstats'):
+            try:
+                dumps.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    dumps.sort(reverse=True)
+    for (_, path) in dumps[keep:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Pruned by another process at the same time
+            pass
@@ -1,29 +1,68 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_socketio import SocketIO, emit, join_room, leave_room
+import json
 import uuid
-from multiprocessing import Process, Queue
-from threading import Thread
-from queue import Empty
+import logging
+from multiprocessing import Process, Queue, Pool, cpu_count
+from queue import SimpleQueue
+from concurrent.futures import TimeoutError as FutureTimeout
 from copy import deepcopy
-from pulsar.tools import sequential_solver, parallel_solver, sat_solver
+from pulsar.tools import run_solver, batch_solve, batch_count, count_solutions, init_batch_worker, default_heuristic
+from pulsar.heuristics import branching_heuristics
+from pulsar.SATSolver import amo_encodings
+from pulsar.WorkerPool import SATWorkerPool
+from pulsar.Budget import Budget, CancelTable
+from pulsar.ResultRouter import ResultRouter
+from pulsar.SolutionCache import SolutionCache
+from pulsar.Portfolio import Portfolio
+from pulsar.Metrics import MetricsRegistry
+from pulsar.WireFormat import wire_formats, check_format, decode_puzzle, encode_payload, to_base64
 
 error_db = {
     200: "Success",
+    202: "Solution pending, it will be delivered asynchronously",
     204: "Response Queue Empty",
     410: "Please request with a connection key",
     411: "Connection Key Invalid",
     412: "Request message contains invalid action",
-    413: "Request message contains invalid puzzle format"
+    413: "Request message contains invalid puzzle format",
+    414: "Request message contains invalid branching heuristic",
+    415: "Request message contains invalid SAT encoding",
+    416: "Request message contains invalid solver limits",
+    417: "Request message contains invalid wire format",
+    503: "Solver queue full, please retry later"
 }
 response_queue = Queue()
 
+logger = logging.getLogger(__name__)
+
+# Default limits of a solve request, overridable per request with 'timeout' (seconds) and 'max_nodes'
+solver_timeout = 60
+solver_max_nodes = None
+
+# POST /solve waits this long (or 'wait' seconds) before falling back to asynchronous delivery. Puzzles up
+# to inline_max_size are solved in the request thread itself by the sequential and DLX solvers
+sync_wait = 10
+inline_max_size = 9
+
+# POST /solve/batch fans the puzzles out over this pool, batch_chunksize puzzles per task
+batch_workers = cpu_count()
+batch_chunksize = 4
+
+# POST /count stops at count_limit solutions unless the request sets 'limit' (null counts all of them)
+count_limit = 2
+
 
 class Pulsar:
     def __init__(self):
 
         self.pulsar = Flask(__name__)
         self.pulsar.add_url_rule('/set', 'take_action', self.take_action, methods=['POST'])
-        # self.pulsar.add_url_rule('/get', 'send_response', self.send_response, methods=['GET'])
+        self.pulsar.add_url_rule('/get', 'send_response', self.send_response, methods=['GET'])
+        self.pulsar.add_url_rule('/solve', 'solve', self.solve, methods=['POST'])
+        self.pulsar.add_url_rule('/solve/batch', 'solve_batch', self.solve_batch, methods=['POST'])
+        self.pulsar.add_url_rule('/count', 'count', self.count, methods=['POST'])
+        self.pulsar.add_url_rule('/metrics', 'metrics', self.export_metrics, methods=['GET'])
 
         self.socketio = SocketIO(self.pulsar, cors_allowed_origins="*")
         self.clients = {}  # Dictionary to track connected clients
@@ -32,71 +71,337 @@ class Pulsar:
         self.socketio.on_event('connect', self.handle_connect)
         self.socketio.on_event('disconnect', self.handle_disconnect)
 
-        # Start the listener thread for checking the response queue
-        self.listener_thread = Thread(target=self.check_and_send_response, daemon=True)
-        self.listener_thread.start()
+        # Cancel flags of the running requests, shared with every solver process started from here on
+        self.cancel_table = CancelTable()
+
+        # Pre-warmed SAT workers, started before any thread of this process
+        self.sat_pool = SATWorkerPool(response_queue, self.cancel_table.flags)
+        self.batch_pool = Pool(batch_workers, initializer=init_batch_worker, initargs=(self.cancel_table.flags,))
+
+        # Solutions of already seen (or equivalent) puzzles, filled from the results of the solvers
+        self.solution_cache = SolutionCache()
+
+        # Engine choice of the 'auto' solver mode, adapted from the results
+        self.portfolio = Portfolio()
 
-        print("Pulsar at your service!")
+        # Search statistics of every solver result, exported on /metrics
+        self.metrics = MetricsRegistry()
+
+        # Route the results of the solver processes to their sessions
+        self.router = ResultRouter(response_queue, deliver=self.deliver_solution, on_result=self.release_result)
+        self.router.start()
+
+        logger.info("Pulsar at your service!")
 
     def take_action(self):
         req_msg = request.json
         session_id = req_msg.get('session_id')
-        print(f"Request received: from client {session_id}")
+        logger.info("Request received: from client %s", session_id)
 
         if req_msg['action'] == 'solve_puzzle':
-            try:
-                while not response_queue.empty():
-                    response_queue.get()
-                puzzle = req_msg['puzzle']
-                solver = req_msg.get('solver')
-                self.trigger_solver(puzzle, solver=solver, session_id=session_id)
-                return self.response(200)
-            except KeyError:
-                return self.response(413)
+            (puzzles, err) = self.read_puzzles(req_msg, [req_msg.get('puzzle')])
+            if err:
+                return self.response(err)
+            (options, err) = self.read_options(req_msg, puzzles)
+            if err:
+                return self.response(err)
+            if not self.trigger_solver(puzzles[0], session_id=session_id, **options):
+                return self.response(503)
+            return self.response(200)
+
+        if req_msg['action'] == 'cancel':
+            return self.response(200, {'cancelled': self.cancel(session_id)})
 
         return self.response(412)
 
+    def solve(self):
+        """
+        Solve a puzzle and answer with the solution inline. When it takes longer than 'wait' seconds the
+        request is answered with 202 and the solution is delivered to the session like an asynchronous one.
+        """
+        req_msg = request.json
+        session_id = req_msg.get('session_id')
+        (puzzles, err) = self.read_puzzles(req_msg, [req_msg.get('puzzle')])
+        if err:
+            return self.response(err)
+        puzzle = puzzles[0]
+        size = len(puzzle)
+        (options, err) = self.read_options(req_msg, puzzles)
+        if err:
+            return self.response(err)
+        wait = req_msg.get('wait', sync_wait)
+        if not (isinstance(wait, (int, float)) and wait >= 0):
+            return self.response(416)
+
+        cached = self.solution_cache.get(puzzle) if options['cache'] else None
+        if cached is not None:
+            return self.response(200, self.wire({'solution': cached, 'duration': 0.0, 'session': session_id},
+                                                options['output']))
+
+        if size <= inline_max_size and options['solver'] in (None, 'sequential', 'DLX'):
+            results = SimpleQueue()
+            run_solver(deepcopy(puzzle), results, session_id, options['solver'], options['heuristic'],
+                       budget=Budget.from_timeout(options['timeout'], options['max_nodes']),
+                       profile=options['profile'], output=options['output'])
+            payload = results.get()
+            self.solution_cache.put(puzzle, payload['solution'])
+            self.metrics.record(payload)
+            return self.response(200, self.wire(payload))
+
+        # Results are routed by a key of this request (the session only gets them after a fallback), a cancel of
+        # the session still stops it
+        request_key = str(uuid.uuid4())
+        future = self.router.subscribe(request_key)
+        if not self.trigger_solver(puzzle, session_id=session_id or request_key, request_key=request_key,
+                                   cache_checked=True, **options):
+            self.router.unsubscribe(request_key, future)
+            return self.response(503)
+
+        try:
+            payload = future.result(timeout=wait)
+        except FutureTimeout:
+            target = session_id or request_key
+            payload = self.router.redirect(request_key, future, target)
+            if payload is None:
+                return self.response(202, {'session': target})
+
+        payload['session'] = session_id
+        return self.response(200, self.wire(payload))
+
+    def solve_batch(self):
+        """
+        Solve a list of puzzles on the batch pool, streaming one JSON line per puzzle in completion order
+        ({"index": position in the request, "solution": ..., "duration": ...}). The batch is cancelled with its
+        session, or when the client stops reading the stream.
+        """
+        req_msg = request.json
+        if not isinstance(req_msg.get('puzzles'), list):
+            return self.response(413)
+        (puzzles, err) = self.read_puzzles(req_msg, req_msg['puzzles'])
+        if err:
+            return self.response(err)
+        (options, err) = self.read_options(req_msg, puzzles)
+        if err:
+            return self.response(err)
+
+        # One cancel slot for the whole batch, under the session (or the batch itself without one)
+        request_key = str(uuid.uuid4())
+        cancel_key = req_msg.get('session_id') or request_key
+        slot = self.cancel_table.acquire(cancel_key, request_key)
+        if slot is None:
+            return self.response(503)
+
+        def stream():
+            try:
+                jobs = []
+                for index, puzzle in enumerate(puzzles):
+                    cached = self.solution_cache.get(puzzle) if options['cache'] else None
+                    if cached is not None:
+                        payload = {'solution': cached, 'duration': 0.0, 'index': index}
+                        yield json.dumps(self.wire(payload, options['output'])) + '\n'
+                    else:
+                        jobs.append((index, puzzle, options['solver'], options['heuristic'], options['encoding'],
+                                     options['amo'], options['timeout'], options['max_nodes'],
+                                     dict(self.portfolio.thresholds), slot))
+
+                for payload in self.batch_pool.imap_unordered(batch_solve, jobs, chunksize=batch_chunksize):
+                    payload['index'] = payload.pop('session')
+                    self.solution_cache.put(puzzles[payload['index']], payload['solution'])
+                    self.portfolio.record(payload)
+                    self.metrics.record(payload)
+                    yield json.dumps(self.wire(payload, options['output'])) + '\n'
+            except GeneratorExit:
+                # The client went away, stop the queued jobs unless the slot is shared with other requests
+                if cancel_key == request_key:
+                    self.cancel_table.cancel(cancel_key)
+                raise
+            finally:
+                self.cancel_table.release(request_key)
+
+        return Response(stream(), mimetype='application/x-ndjson')
+
+    def count(self):
+        """
+        Count the solutions of a puzzle up to 'limit' and answer inline ({"count", "exact", "unique", ...}, see
+        tools.count_solutions). Puzzles up to inline_max_size are counted in the request thread, larger ones
+        on the batch pool. A cancel of the session stops the count.
+        """
+        req_msg = request.json
+        (puzzles, err) = self.read_puzzles(req_msg, [req_msg.get('puzzle')])
+        if err:
+            return self.response(err)
+        puzzle = puzzles[0]
+        size = len(puzzle)
+        (options, err) = self.read_options(req_msg)
+        if err:
+            return self.response(err)
+        limit = req_msg.get('limit', count_limit)
+        if not (limit is None or (isinstance(limit, int) and limit > 0)):
+            return self.response(416)
+
+        request_key = str(uuid.uuid4())
+        slot = self.cancel_table.acquire(req_msg.get('session_id') or request_key, request_key)
+        if slot is None:
+            return self.response(503)
+
+        thresholds = dict(self.portfolio.thresholds)
+        try:
+            if size <= inline_max_size:
+                budget = Budget.from_timeout(options['timeout'], options['max_nodes'], self.cancel_table.flags, slot)
+                result = count_solutions(puzzle, limit, options['solver'], options['heuristic'],
+                                         options['encoding'], options['amo'], budget, thresholds)
+            else:
+                result = self.batch_pool.apply(batch_count, ((puzzle, limit, options['solver'], options['heuristic'],
+                                                              options['encoding'], options['amo'], options['timeout'],
+                                                              options['max_nodes'], thresholds, slot),))
+        finally:
+            self.cancel_table.release(request_key)
+        result['session'] = req_msg.get('session_id')
+        return self.response(200, result)
+
+    def export_metrics(self):
+        """ Solver counters and histograms in the Prometheus text format """
+        text = self.metrics.render({'pulsar_cache_hits_total': self.solution_cache.hits,
+                                    'pulsar_cache_misses_total': self.solution_cache.misses})
+        return Response(text, mimetype='text/plain; version=0.0.4')
+
     @staticmethod
-    def trigger_solver(puzzle, solver='sequential', session_id=None):
+    def read_puzzles(req_msg, puzzles):
+        """ Puzzles of a request message decoded from its wire 'format', returns (puzzles, error code) """
+        fmt = req_msg.get('format', 'lists')
+        if fmt not in wire_formats:
+            return None, 417
+        try:
+            return [decode_puzzle(puzzle, fmt) for puzzle in puzzles], None
+        except (ValueError, TypeError):
+            return None, 413
+
+    @staticmethod
+    def read_options(req_msg, puzzles=()):
+        """
+        Solver options of a request message as trigger_solver keywords, returns (options, error code). The
+        output format has to encode solutions of the size of every puzzle.
+        """
+        heuristic = req_msg.get('heuristic', default_heuristic)
+        if heuristic not in branching_heuristics and heuristic != 'legacy':
+            return None, 414
+        encoding = req_msg.get('encoding', 'naive')
+        amo = req_msg.get('amo', 'pairwise')
+        if encoding not in ('naive', 'compact') or amo not in amo_encodings:
+            return None, 415
+        timeout = req_msg.get('timeout', solver_timeout)
+        max_nodes = req_msg.get('max_nodes', solver_max_nodes)
+        if not all(limit is None or (isinstance(limit, (int, float)) and limit > 0)
+                   for limit in (timeout, max_nodes)):
+            return None, 416
+        output = req_msg.get('output', req_msg.get('format', 'lists'))
+        if output not in wire_formats:
+            return None, 417
+        try:
+            for puzzle in puzzles:
+                check_format(output, len(puzzle))
+        except ValueError:
+            return None, 417
+
+        # A profiled request has to run its solver, so it skips the solution cache
+        profile = bool(req_msg.get('profile', False))
+        options = {'solver': req_msg.get('solver'), 'heuristic': heuristic, 'encoding': encoding, 'amo': amo,
+                   'timeout': timeout, 'max_nodes': max_nodes,
+                   'cache': bool(req_msg.get('cache', True)) and not profile, 'profile': profile, 'output': output}
+        return options, None
+
+    def trigger_solver(self, puzzle, solver='sequential', session_id=None, heuristic=default_heuristic,
+                       encoding='naive', amo='pairwise', timeout=solver_timeout, max_nodes=solver_max_nodes,
+                       cache=True, profile=False, output='lists', request_key=None, cache_checked=False):
         """
         Trigger the solver process in the background and send results to the response queue.
         This function will immediately return after triggering the solver.
+        SAT requests go to the persistent worker pool, False is returned when its queue is full (or too many
+        requests are in flight to track their cancel flags). Puzzles found in the solution cache are answered
+        right away without starting a solver, unless the caller already looked them up (cache_checked). With
+        profile the solver runs under cProfile and its payload carries a 'profile' report. The payload is
+        tagged with the output wire format of its solution.
+        The solver routes its payload by a key of the request (request_key, or a new one forwarded to the
+        session), the cancel slot of the request is released by that key and it is cancelled through its session.
         """
-        if solver == 'parallel':
-            p = Process(target=parallel_solver, args=(deepcopy(puzzle), response_queue, session_id))
-        elif solver == 'SAT':
-            p = Process(target=sat_solver, args=(deepcopy(puzzle), response_queue, session_id))
-        else:
-            p = Process(target=sequential_solver, args=(deepcopy(puzzle), response_queue, session_id))
+        cached = self.solution_cache.get(puzzle) if cache and not cache_checked else None
+        if cached is not None:
+            self.router.route({'solution': cached, 'duration': 0.0, 'session': request_key or session_id,
+                               'format': output}, notify=False)
+            return True
+
+        forwarded = request_key is None
+        if forwarded:
+            request_key = str(uuid.uuid4())
+        slot = self.cancel_table.acquire(session_id, request_key)
+        if slot is None:
+            return False
+        budget = Budget.from_timeout(timeout, max_nodes, self.cancel_table.flags, slot)
 
+        # Remembered before the solver starts, its result may come back right away
+        if forwarded:
+            self.router.forward(request_key, session_id)
+        self.solution_cache.expect(request_key, puzzle)
+
+        if solver == 'SAT':
+            if not self.sat_pool.submit(deepcopy(puzzle), request_key, encoding, amo, budget, profile=profile,
+                                        output=output):
+                self.cancel_table.release(request_key)
+                self.solution_cache.forget(request_key, puzzle)
+                if forwarded:
+                    self.router.forward(request_key, None)
+                return False
+            return True
+
+        p = Process(target=run_solver,
+                    args=(deepcopy(puzzle), response_queue, request_key, solver, heuristic, encoding, amo, budget,
+                          dict(self.portfolio.thresholds), True, profile, output))
         p.start()
+        return True
+
+    def cancel(self, session_id):
+        """ Stop the running requests of a session, their solvers give up at the next check """
+        cancelled = self.cancel_table.cancel(session_id)
+        if cancelled:
+            logger.info("Requests of client %s cancelled", session_id)
+        return cancelled
 
-    def check_and_send_response(self):
+    def send_response(self):
+        """ Results of a session that were not delivered over its WebSocket, oldest first """
+        session_id = request.args.get('session_id')
+        if not session_id:
+            return self.response(410)
+
+        results = self.router.collect(session_id)
+        if not results:
+            return self.response(204)
+        return self.response(200, {'results': [self.wire(payload) for payload in results]})
+
+    def deliver_solution(self, payload):
         """
-        Check the response queue in a background thread and emit the solution to clients
-        using SocketIO. This ensures the solution is sent once it's ready.
+        Called by the result router for every result nobody is waiting for. Returns False when the client
+        is not connected, the result is then kept in the session's mailbox.
         """
-        while True:
-            try:
-                # Get data from the queue (non-blocking with timeout)
-                payload = response_queue.get(timeout=0.1)
-
-                # Use the start_background_task method to safely emit from the background thread
-                if payload['session'] in self.clients:
-                    self.socketio.start_background_task(self.emit_solution, payload)
-            except Empty:
-                pass
-            except ValueError:
-                print(f"Error occurred while getting data from response queue")
-                return
+        if payload['session'] not in self.clients:
+            return False
+
+        # Use the start_background_task method to safely emit from the background thread
+        self.socketio.start_background_task(self.emit_solution, payload)
+        return True
+
+    def release_result(self, payload):
+        self.cancel_table.release(payload['session'])
+        self.solution_cache.fulfil(payload)
+        self.portfolio.record(payload)
+        self.metrics.record(payload)
 
     def emit_solution(self, payload):
         """ Emit the solution to the client. This function runs in the main process. """
         try:
-            self.socketio.emit('solution_found', payload, room=payload['session'])
-            print(f"Solution sent to client {payload['session']}")
+            self.socketio.emit('solution_found', encode_payload(payload), room=payload['session'])
+            logger.info("Solution sent to client %s", payload['session'])
         except Exception as e:
-            print(f"Error emitting solution: {e}")
+            logger.error("Error emitting solution: %s", e)
 
     def handle_connect(self):
         """ When a client connects, generate and send a unique session ID """
@@ -104,21 +409,29 @@ class Pulsar:
         self.clients[session_id] = request.sid  # Map session ID to WebSocket session
         join_room(session_id)  # Join a private room for this client
         emit('session_id', {'session_id': session_id})  # Send ID to client
-        print(f"Client {session_id} connected")
+        logger.info("Client %s connected", session_id)
 
     def handle_disconnect(self):
-        """ When a client disconnects, remove them from tracking """
+        """ When a client disconnects, remove them from tracking and cancel their running requests """
         for session_id, sid in list(self.clients.items()):
             if sid == request.sid:
                 leave_room(session_id)
                 del self.clients[session_id]
-                print(f"Client {session_id} disconnected")
+                self.cancel(session_id)
+                logger.info("Client %s disconnected", session_id)
                 break
 
     def run(self, host='0.0.0.0', port=5000, debug=False):
         """Starts the Flask-SocketIO server."""
         self.socketio.run(self.pulsar, host=host, port=port, debug=debug, allow_unsafe_werkzeug=True)
 
+    @staticmethod
+    def wire(payload, output=None):
+        """ Payload for a JSON response, its solution encoded in output (default: the format it is tagged with) """
+        if output is not None:
+            payload = dict(payload, format=output)
+        return encode_payload(payload, to_base64)
+
     @staticmethod
     def response(err, data=None):
         if not data:
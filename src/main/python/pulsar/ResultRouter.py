@@ -0,0 +1,133 @@
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from threading import Thread, Lock
+
+
+logger = logging.getLogger(__name__)
+
+mailbox_size = 32
+mailbox_sessions_max = 1024
+
+
+class ResultRouter:
+    """
+    Delivers the payloads of the solver processes to the session they belong to.
+
+    A single thread blocks on the shared result queue (no polling) and routes every payload, in order:
+    to a future waiting for a result of that session (subscribe), to deliver (e.g. the session's WebSocket
+    room, returning False when the client is not connected), or else into the session's mailbox, from
+    where collect hands it out later. Nothing is dropped because another request arrived; only the
+    mailboxes are bounded (mailbox_size payloads per session, mailbox_sessions_max sessions).
+    """
+    def __init__(self, result_queue, deliver=None, on_result=None):
+        self.result_queue = result_queue
+        self.deliver = deliver
+        self.on_result = on_result
+
+        self.lock = Lock()
+        self.waiters = {}
+        self.redirects = {}
+        self.mailboxes = OrderedDict()
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ Wake the routing thread up with a sentinel and wait for it """
+        self.result_queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            try:
+                payload = self.result_queue.get()
+            except (EOFError, OSError, ValueError):
+                logger.error("Error occurred while getting data from response queue")
+                return
+            if payload is None:
+                return
+            self.route(payload)
+
+    def route(self, payload, notify=True):
+        """ Deliver one payload, on_result is skipped for payloads that did not come from a solver (notify) """
+        session_id = payload.get('session')
+        if notify and (self.on_result is not None):
+            self.on_result(payload)
+
+        with self.lock:
+            if session_id in self.redirects:
+                session_id = self.redirects.pop(session_id)
+                payload = dict(payload, session=session_id)
+
+            waiters = self.waiters.get(session_id)
+            while waiters:
+                future = waiters.popleft()
+                if not waiters:
+                    del self.waiters[session_id]
+                if future.set_running_or_notify_cancel():
+                    future.set_result(payload)
+                    return
+
+        if (self.deliver is not None) and self.deliver(payload):
+            return
+
+        with self.lock:
+            if session_id not in self.mailboxes:
+                if len(self.mailboxes) >= mailbox_sessions_max:
+                    self.mailboxes.popitem(last=False)
+                self.mailboxes[session_id] = deque(maxlen=mailbox_size)
+            self.mailboxes[session_id].append(payload)
+
+    def subscribe(self, session_id):
+        """ Future resolved with the next payload of the session, cancel it to give up waiting """
+        future = Future()
+        with self.lock:
+            self.waiters.setdefault(session_id, deque()).append(future)
+        return future
+
+    def unsubscribe(self, session_id, future):
+        with self.lock:
+            waiters = self.waiters.get(session_id)
+            if waiters and future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self.waiters.pop(session_id, None)
+        future.cancel()
+
+    def redirect(self, session_id, future, target):
+        """
+        Stop waiting on future and route the next payload of session_id to target instead (a synchronous
+        request falling back to asynchronous delivery). Returns the payload if it arrived in the meantime.
+        """
+        with self.lock:
+            if future.done() and not future.cancelled():
+                return future.result()
+            waiters = self.waiters.get(session_id)
+            if waiters and future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self.waiters.pop(session_id, None)
+            future.cancel()
+            self.redirects[session_id] = target
+        return None
+
+    def forward(self, session_id, target):
+        """ Route the next payload of session_id to target, None drops the forwarding again """
+        with self.lock:
+            if target is None:
+                self.redirects.pop(session_id, None)
+            else:
+                self.redirects[session_id] = target
+
+    def collect(self, session_id):
+        """ Payloads kept in the mailbox of the session, oldest first; the mailbox is emptied """
+        with self.lock:
+            mailbox = self.mailboxes.pop(session_id, None)
+        return list(mailbox) if mailbox else []
+
+    def discard(self, session_id):
+        with self.lock:
+            self.mailboxes.pop(session_id, None)
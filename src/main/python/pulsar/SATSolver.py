@@ -1,126 +1,453 @@
+import os
+import logging
+from array import array
+
 from pysat.solvers import Glucose3
 from pulsar.useful_tools import flatten_index_equal_depth, get_index_equal_depth
+from pulsar.CandidateGrid import CandidateGrid
+from pulsar.Solver import Solver
+
 
+logger = logging.getLogger(__name__)
 
+# Look for a second solution after the first one (logged when found), only done without a request budget
 check_all_solutions = True
 
+# Structural CNF per grid size, built once per process. When cnf_cache_dir is set the clauses are also
+# stored there as a flat array of zero terminated clauses and loaded back instead of being regenerated.
+base_encodings = {}
+cnf_cache_dir = None
+
+# One loaded solver per grid size, reused across the puzzles solved in this process
+warm_solvers = {}
+
+
+def sudoku_rules(size):
+    """ Structural clauses of an N x N sudoku, independent of the clues """
+    rank = int(size**0.5)
+
+    def var(*args):
+        return flatten_index_equal_depth(size, *args)
+
+    # Rule 1:
+    # Every cell needs to have at least one true flag on the third dimension
+    for i in range(size):
+        for j in range(size):
+            yield [var(i, j, k) for k in range(size)]
+
+    # Rule 2: Uniqueness on depth
+    # Every cell needs to have only one true flag on the third dimension
+    for i in range(size):
+        for j in range(size):
+            for k1 in range(size):
+                for k2 in range(k1 + 1, size):
+                    yield [-var(i, j, k1), -var(i, j, k2)]
+
+    # Rule 3: Uniqueness on row and column
+    # Every row in its third dimension should have only one true flag, so should the column
+    for x in range(size):
+        for k in range(size):
+            for y1 in range(size):
+                for y2 in range(y1 + 1, size):
+                    yield [-var(x, y1, k), -var(x, y2, k)]
+                    yield [-var(y1, x, k), -var(y2, x, k)]
+
+    # Rule 4: Uniqueness on Subgrid
+    # Every subgrid in its third dimension should have only one true flag. Pairs sharing a row or a
+    # column are already covered by Rule 3, so only the remaining pairs are emitted, each one once
+    for i in range(0, size, rank):
+        for j in range(0, size, rank):
+            for k in range(size):
+                box_cells = [(i1, j1) for i1 in range(i, i + rank) for j1 in range(j, j + rank)]
+                for idx, (i1, j1) in enumerate(box_cells):
+                    for (i2, j2) in box_cells[idx + 1:]:
+                        if (i2 != i1) and (j2 != j1):
+                            yield [-var(i1, j1, k), -var(i2, j2, k)]
+
+
+def get_base_encoding(size):
+    """ Cached structural clauses for a grid size, from memory, the disk cache or generated """
+    if size in base_encodings:
+        return base_encodings[size]
+
+    clauses = None
+    cache_file = os.path.join(cnf_cache_dir, f'sudoku_{size}.cnf.bin') if cnf_cache_dir else None
+    if cache_file and os.path.exists(cache_file):
+        flat = array('i')
+        with open(cache_file, 'rb') as f:
+            flat.frombytes(f.read())
+        clauses = unflatten_clauses(flat)
+
+    if clauses is None:
+        clauses = list(sudoku_rules(size))
+        if cache_file:
+            os.makedirs(cnf_cache_dir, exist_ok=True)
+            with open(cache_file, 'wb') as f:
+                f.write(flatten_clauses(clauses).tobytes())
+
+    base_encodings[size] = clauses
+    return clauses
+
+
+def flatten_clauses(clauses):
+    flat = array('i')
+    for clause in clauses:
+        flat.extend(clause)
+        flat.append(0)
+    return flat
+
+
+def unflatten_clauses(flat):
+    clauses = []
+    clause = []
+    for lit in flat:
+        if lit:
+            clause.append(lit)
+        else:
+            clauses.append(clause)
+            clause = []
+    return clauses
+
+
+def amo_pairwise(lits, new_var):
+    for idx in range(len(lits)):
+        for idx1 in range(idx + 1, len(lits)):
+            yield [-lits[idx], -lits[idx1]]
+
+
+def amo_sequential(lits, new_var):
+    """ Sequential counter (Sinz): 3n clauses and n - 1 auxiliary variables instead of n^2 / 2 clauses """
+    if len(lits) <= 4:
+        yield from amo_pairwise(lits, new_var)
+        return
+
+    prev = new_var()
+    yield [-lits[0], prev]
+    for x in lits[1:-1]:
+        s = new_var()
+        yield [-x, s]
+        yield [-prev, s]
+        yield [-x, -prev]
+        prev = s
+    yield [-lits[-1], -prev]
+
+
+def amo_commander(lits, new_var, group_size=3):
+    """ Commander encoding (Klieber and Kwon): pairwise within small groups, recursively over the commanders """
+    if len(lits) <= group_size + 1:
+        yield from amo_pairwise(lits, new_var)
+        return
+
+    commanders = []
+    for start in range(0, len(lits), group_size):
+        group = lits[start:start + group_size]
+        commander = new_var()
+        commanders.append(commander)
+        yield from amo_pairwise(group, new_var)
+        for x in group:
+            yield [-x, commander]
+
+    yield from amo_commander(commanders, new_var, group_size)
+
+
+amo_encodings = {
+    'pairwise': amo_pairwise,
+    'sequential': amo_sequential,
+    'commander': amo_commander,
+}
+
 
 class SATSolver:
-    def __init__(self, puzzle):
-        self.sudoku = Glucose3()
+    """
+    Glucose3 based solver with two encodings:
+
+    'naive':   the cached structural encoding of the grid size over all N^3 variables. Clues are passed as
+               assumptions to every solve call, so the same (warm) instance can serve any number of puzzles.
+    'compact': built for one puzzle. The givens are propagated first, fixed cells get no variables and only
+               the remaining candidates are encoded, with at-least-one clauses per cell and per unit digit and
+               the at-most-one constraints in the chosen amo encoding ('pairwise', 'sequential', 'commander').
+    """
+    def __init__(self, puzzle, encoding='naive', amo='pairwise'):
         self.size = len(puzzle)
         self.rank = int(self.size**0.5)
+        self.encoding = encoding
+        self.amo = amo
+
+        self.load(puzzle)
+
+    def load(self, puzzle):
+        """ Fresh Glucose3 instance with the encoding of this puzzle """
+        self.sudoku = Glucose3()
         self.puzzle = puzzle
 
-        self.define_sudoku_rules()
+        self.state_invalid = False
+        self.state_cancelled = False
+        self.budget = None
+        # Conflicts and decisions of the last solve, a warm instance accumulates them across puzzles otherwise
+        self.conflicts = 0
+        self.decisions = 0
+        self.difficulty_score = None
+        # Compact encoding: values fixed before encoding and the variable <-> (i, j, k) maps
+        self.fixed = None
+        self.var_map = None
+        self.var_decode = None
+
+        # Variables above size^3 are activation literals of temporary clauses
+        self.next_var = self.size ** 3 + 1
+
+        if self.encoding == 'compact':
+            self.define_compact_rules()
+        else:
+            self.define_sudoku_rules()
 
     def var(self, *args):
+        if self.var_map is not None:
+            return self.var_map.get(args)
         return flatten_index_equal_depth(self.size, *args)
 
     def decode_var(self, x):
+        if self.var_decode is not None:
+            return self.var_decode.get(x)
+        if x > self.size ** 3:
+            return None
         return get_index_equal_depth(3, self.size, x)
 
+    def new_var(self):
+        var = self.next_var
+        self.next_var += 1
+        return var
+
     def define_sudoku_rules(self):
+        self.sudoku.append_formula(get_base_encoding(self.size))
 
-        # Rule 1:
-        # Every cell needs to have at least one true flag on the third dimension
-        for i in range(self.size):
-            for j in range(self.size):
-                self.sudoku.add_clause([self.var(i, j, k) for k in range(self.size)])
+    def define_compact_rules(self):
+        size = self.size
+        cgrid = CandidateGrid(size)
+        actions = [{'idx': (i, j), 'val': self.puzzle[i][j]}
+                   for i in range(size) for j in range(size) if self.puzzle[i][j]]
 
-        # Rule 2: Uniqueness on depth
-        # Every cell needs to have only one true flag on the third dimension
-        for i in range(self.size):
-            for j in range(self.size):
-                for k1 in range(self.size):
-                    for k2 in range(k1 + 1, self.size):
-                        self.sudoku.add_clause([-self.var(i, j, k1), -self.var(i, j, k2)])
-
-        # Rule 3: Uniqueness on row and column
-        # Every row in its third dimension should have only one true flag, so should the column
-        for x in range(self.size):
-            for k in range(self.size):
-                for y1 in range(self.size):
-                    for y2 in range(y1 + 1, self.size):
-                        self.sudoku.add_clause([-self.var(x, y1, k), -self.var(x, y2, k)])
-                        self.sudoku.add_clause([-self.var(y1, x, k), -self.var(y2, x, k)])
-
-        # Rule 4: Uniqueness on Subgrid
-        # Every subgrid in its third dimension should have only one true flag
-        for i in range(0, self.size, self.rank):
-            for j in range(0, self.size, self.rank):
-                for k in range(self.size):
-                    for i1 in range(i, i + self.rank):
-                        for j1 in range(j, j + self.rank):
-                            impacted_cells = [self.var(i1, j1, k)]
-                            for i2 in range(i, i + self.rank):
-                                for j2 in range(j, j + self.rank):
-                                    if (i2 != i1) and (j2 != j1):
-                                        impacted_cells.append(self.var(i2, j2, k))
-
-                            for idx in range(len(impacted_cells)):
-                                for idx1 in range(idx + 1, len(impacted_cells)):
-                                    self.sudoku.add_clause([-impacted_cells[idx], -impacted_cells[idx1]])
-
-    def solve(self):
+        # Singles propagation keeps every solution, so its eliminations can be dropped from the CNF
+        solver = Solver(cgrid, actions, strategies=[])
+        solver.solve()
+        if solver.state_invalid:
+            self.state_invalid = True
+            return
 
-        # Apply Hints
+        cells = cgrid.cells
+        self.fixed = [[cells[i * size + j].bit_length() if not cells[i * size + j] & (cells[i * size + j] - 1) else 0
+                       for j in range(size)] for i in range(size)]
+        self.var_map = {}
+        self.var_decode = {}
+        self.next_var = 1
+        for idx, mask in enumerate(cells):
+            if mask & (mask - 1):
+                (i, j) = divmod(idx, size)
+                for k in range(size):
+                    if (mask >> k) & 1:
+                        var = self.new_var()
+                        self.var_map[(i, j, k)] = var
+                        self.var_decode[var] = (i, j, k)
+
+        amo = amo_encodings[self.amo]
+        clauses = []
+
+        # Every open cell takes exactly one of its candidates
+        for idx, mask in enumerate(cells):
+            if mask & (mask - 1):
+                (i, j) = divmod(idx, size)
+                lits = [self.var_map[(i, j, k)] for k in range(size) if (mask >> k) & 1]
+                clauses.append(lits)
+                clauses.extend(amo(lits, self.new_var))
+
+        # Every digit not yet placed in a row, column or box goes to exactly one of its open cells
+        for unit, unit_cells in enumerate(cgrid.topology.units):
+            for k in range(size):
+                if cgrid.placed[unit] & (1 << k):
+                    continue
+                lits = [self.var_map[divmod(idx, size) + (k,)] for idx in unit_cells
+                        if (cells[idx] >> k) & 1 and cells[idx] & (cells[idx] - 1)]
+                clauses.append(lits)
+                clauses.extend(amo(lits, self.new_var))
+
+        self.sudoku.append_formula(clauses)
+
+    def get_assumptions(self):
+        """ Clues of the current puzzle as assumption literals (none for the compact encoding) """
+        if self.encoding == 'compact':
+            return []
+
+        assumptions = []
         for i in range(self.size):
             for j in range(self.size):
                 if self.puzzle[i][j]:
-                    # print(i, j, self.puzzle[i][j])
-                    self.sudoku.add_clause([self.var(i, j, self.puzzle[i][j] - 1)])
+                    assumptions.append(self.var(i, j, self.puzzle[i][j] - 1))
+        return assumptions
+
+    def solve(self, puzzle=None, budget=None):
+        """
+        Solution of the puzzle in the list-of-lists format, None if there is none. With a Budget the solver
+        is interrupted once it is cancelled or past its deadline and max_nodes caps the conflicts; None is
+        returned then as well, with state_cancelled set. The search for a second solution (only logged, see
+        check_all_solutions) is skipped with a Budget, it would spend the budget of the request.
+        """
+        if puzzle is not None:
+            if len(puzzle) != self.size:
+                raise ValueError(f"SATSolver for size {self.size} cannot solve a puzzle of size {len(puzzle)}")
+            if self.encoding == 'compact' and puzzle is not self.puzzle:
+                # The compact encoding depends on the clues, build it again for the new puzzle
+                self.load(puzzle)
+            self.puzzle = puzzle
+
+        self.budget = budget
+        self.state_cancelled = False
+        self.conflicts = 0
+        self.decisions = 0
+        if self.state_invalid:
+            logger.debug("No Solution exists!")
+            return None
+
+        # Apply Hints
+        assumptions = self.get_assumptions()
 
         # Solve
-        status = self.sudoku.solve()
+        status = self.run(assumptions)
+        if self.state_cancelled:
+            logger.debug("SAT search stopped, budget exceeded or request cancelled")
+            return None
 
         if status:
-            print("Solved!")
-
             solver_solution = self.sudoku.get_model()
 
             solutions = []
-            while solver_solution and len(solutions) < 2:
-                solution = [[[] for _ in range(self.size)] for _ in range(self.size)]
-                for var in solver_solution:
-                    if var >= 0:
-                        (i, j, k) = self.decode_var(var)
-                        solution[i][j] = [k + 1]
-                solutions.append(solution)
+            while (solver_solution is not None) and len(solutions) < 2:
+                solutions.append(self.decode_model(solver_solution))
 
                 self.rate_difficulty()
-                solver_solution = self.check_next_solution(solution)
+                if len(solutions) < 2 and check_all_solutions and budget is None:
+                    solver_solution = self.check_next_solution(solutions[-1], assumptions)
+                else:
+                    solver_solution = None
 
             if len(solutions) > 1:
-                print(f"Puzzle has more than 1 solution!")
+                logger.debug("Puzzle has more than 1 solution!")
 
             return solutions[0]
 
-        print("No Solution exists!")
+        logger.debug("No Solution exists!")
         return None
 
-    def check_next_solution(self, prev_solution):
-        # Add a negation clause to block the first solution
-        negation_clause = []
+    def decode_model(self, model):
+        if self.fixed is not None:
+            solution = [[[x] if x else [] for x in row] for row in self.fixed]
+        else:
+            solution = [[[] for _ in range(self.size)] for _ in range(self.size)]
+
+        for var in model:
+            if var > 0:
+                cell = self.decode_var(var)
+                if cell is not None:
+                    (i, j, k) = cell
+                    solution[i][j] = [k + 1]
+        return solution
+
+    def check_next_solution(self, prev_solution, assumptions=()):
+        # Block the previous solution under a fresh activation literal, so the clause can be retired
+        # afterwards and the solver stays usable for other puzzles
+        activation = self.new_var()
+        self.sudoku.add_clause(self.blocking_clause(prev_solution, activation))
+
+        model = None
+        if self.run(list(assumptions) + [activation]):
+            model = self.sudoku.get_model()
+
+        self.sudoku.add_clause([-activation])
+        return model
+
+    def blocking_clause(self, solution, activation):
+        """ Clause ruling out the solution while the activation literal is assumed """
+        clause = [-activation]
         for i in range(self.size):
             for j in range(self.size):
-                k = prev_solution[i][j][0] - 1
-                negation_clause.append(-self.var(i, j, k))
+                var = self.var(i, j, solution[i][j][0] - 1)
+                if var is not None:
+                    clause.append(-var)
+        return clause
 
-        self.sudoku.add_clause(negation_clause)
+    def enumerate_solutions(self, limit=None, budget=None):
+        """
+        Generator over the solutions of the loaded puzzle (up to limit) in the list-of-lists format. Every
+        solution found is blocked under one activation literal, retired when the generator finishes, so the
+        instance stays usable. Stops with state_cancelled set when the budget runs out.
+        """
+        self.budget = budget
+        self.state_cancelled = False
+        self.conflicts = 0
+        self.decisions = 0
+        if self.state_invalid:
+            return
 
-        if self.sudoku.solve():
-            return self.sudoku.get_model()
+        assumptions = self.get_assumptions()
+        activation = self.new_var()
+        count = 0
+        try:
+            while (limit is None) or count < limit:
+                if not self.run(assumptions + [activation]):
+                    return
+                solution = self.decode_model(self.sudoku.get_model())
+                yield solution
+                count += 1
+                self.sudoku.add_clause(self.blocking_clause(solution, activation))
+        finally:
+            self.sudoku.add_clause([-activation])
 
-        return None
+    def count_solutions(self, limit=None, budget=None):
+        """ Number of solutions, stopping as soon as limit is reached """
+        return sum(1 for _ in self.enumerate_solutions(limit, budget))
+
+    def run(self, assumptions):
+        """
+        One (possibly limited) SAT call, sets state_cancelled when the budget interrupted it. Its conflicts and
+        decisions are added to those of the current solve.
+        """
+        before = self.sudoku.accum_stats()
+        try:
+            return self.limited_run(assumptions)
+        finally:
+            after = self.sudoku.accum_stats()
+            self.conflicts += after.get('conflicts', 0) - before.get('conflicts', 0)
+            self.decisions += after.get('decisions', 0) - before.get('decisions', 0)
+
+    def limited_run(self, assumptions):
+        budget = self.budget
+        if budget is None:
+            return self.sudoku.solve(assumptions=assumptions)
+        if budget.exceeded():
+            self.state_cancelled = True
+            return None
+
+        if budget.max_nodes is not None:
+            self.sudoku.conf_budget(budget.max_nodes)
+        watcher = budget.watch(self.sudoku.interrupt)
+        try:
+            status = self.sudoku.solve_limited(assumptions=assumptions, expect_interrupt=True)
+        finally:
+            watcher.set()
+            self.sudoku.clear_interrupt()
+            # The conflict budget stays on the solver, a warm one would pass it on to the next request
+            if budget.max_nodes is not None:
+                self.sudoku.conf_budget(-1)
+
+        if status is None:
+            self.state_cancelled = True
+        return status
 
     def rate_difficulty(self):
         stats = self.sudoku.accum_stats()
 
         # Extract relevant statistics
         num_clauses = stats.get("clauses", 0)
-        num_conflicts = stats.get("conflicts", 0)
-        num_decisions = stats.get("decisions", 0)
+        num_conflicts = self.conflicts
+        num_decisions = self.decisions
         num_propagations = stats.get("propagations", 0)
 
         # Basic formula to estimate difficulty (adjust weights as needed)
@@ -131,7 +458,16 @@ class SATSolver:
                 (num_propagations / 500)
         )
 
-        # Classify difficulty based on the score
-        stats['difficulty_score'] = difficulty_score
-        print(stats)
-        
\ No newline at end of file
+        self.difficulty_score = difficulty_score
+        logger.debug("SAT difficulty score %s", difficulty_score)
+        return difficulty_score
+
+
+def get_warm_solver(puzzle):
+    """ Cached SATSolver for the size of the puzzle, set up to solve this puzzle """
+    size = len(puzzle)
+    if size not in warm_solvers:
+        warm_solvers[size] = SATSolver(puzzle)
+    solver = warm_solvers[size]
+    solver.puzzle = puzzle
+    return solver
@@ -0,0 +1,123 @@
+from collections import OrderedDict, deque
+from threading import Lock
+
+from pulsar.Canonical import canonicalize
+from pulsar.Topology import get_topology
+
+
+cache_entries_max = 100000
+pending_per_session = 64
+
+
+class SolutionCache:
+    """
+    LRU cache of solved puzzles keyed by their canonical form, so repeated and equivalent puzzles are
+    answered without running a solver. Solutions are stored for the canonical grid and mapped back through
+    the transform of the puzzle asking for them.
+
+    Results of the solvers only carry the session, so the puzzles in flight are remembered per session
+    (expect) and a result is stored for the pending puzzle it actually solves (fulfil). Only complete
+    solutions that agree with the givens are stored.
+    """
+    def __init__(self, max_entries=cache_entries_max):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, puzzle):
+        """ Cached solution of the puzzle in the list-of-lists format, None on a miss """
+        key, transform = canonicalize(puzzle)
+        with self.lock:
+            solution = self.entries.get(key)
+            if solution is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return transform.restore(solution)
+
+    def put(self, puzzle, solution, canonical=None):
+        if not is_solution_of(puzzle, solution):
+            return False
+
+        key, transform = canonical or canonicalize(puzzle)
+        canonical_grid = transform.apply([[cell[0] for cell in row] for row in solution])
+        canonical_solution = [[[val] for val in row] for row in canonical_grid]
+        with self.lock:
+            self.entries[key] = canonical_solution
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return True
+
+    def expect(self, session_id, puzzle):
+        """ Remember a puzzle sent to a solver for the session, its result is cached by fulfil """
+        canonical = canonicalize(puzzle)
+        with self.lock:
+            self.pending.setdefault(session_id, deque(maxlen=pending_per_session)).append((puzzle, canonical))
+
+    def forget(self, session_id, puzzle):
+        """ Drop a pending puzzle whose solver could not be started """
+        with self.lock:
+            pending = self.pending.get(session_id)
+            for entry in list(pending or ()):
+                if entry[0] is puzzle:
+                    pending.remove(entry)
+                    break
+            if session_id in self.pending and not pending:
+                del self.pending[session_id]
+
+    def fulfil(self, payload):
+        """ Cache the solution of a solver payload for the pending puzzle of its session it solves """
+        session_id = payload.get('session')
+        solution = payload.get('solution')
+        with self.lock:
+            pending = self.pending.get(session_id)
+            if not pending:
+                return False
+
+            match = None
+            if solution is not None:
+                for entry in pending:
+                    if is_solution_of(entry[0], solution):
+                        match = entry
+                        break
+            if match is None:
+                # Unsolved (or unmatched) results free the oldest entry of the session
+                match = pending[0]
+                solution = None
+            pending.remove(match)
+            if not pending:
+                del self.pending[session_id]
+
+        if solution is None:
+            return False
+        return self.put(match[0], solution, match[1])
+
+
+def is_solution_of(puzzle, solution):
+    """ True if solution (list-of-lists format) is a complete, valid grid that keeps the givens of puzzle """
+    size = len(puzzle)
+    if (solution is None) or len(solution) != size:
+        return False
+
+    values = []
+    for i in range(size):
+        if len(solution[i]) != size:
+            return False
+        for j in range(size):
+            cell = solution[i][j]
+            if len(cell) != 1 or not (1 <= cell[0] <= size):
+                return False
+            if puzzle[i][j] and puzzle[i][j] != cell[0]:
+                return False
+            values.append(cell[0])
+
+    full = set(range(1, size + 1))
+    for unit in get_topology(size).units:
+        if {values[idx] for idx in unit} != full:
+            return False
+    return True
@@ -1,18 +1,58 @@
+from pulsar.CandidateGrid import CandidateGrid
+from pulsar.Topology import get_topology
+from pulsar.strategies import default_strategies
+
+
 class Solver:
-    def __init__(self, grid, actions=[]):
+    def __init__(self, grid, actions=[], strategies=None, budget=None):
         super().__init__()
 
-        self.size = len(grid)
-        self.rank = int(self.size**0.5)
-        self.grid = grid
+        # Candidates are kept as bitmasks internally, the list-of-lists format is converted on the way in
+        if isinstance(grid, CandidateGrid):
+            self.cgrid = grid
+        else:
+            self.cgrid = CandidateGrid.from_lists(grid)
+
+        self.size = self.cgrid.size
+        self.rank = self.cgrid.rank
+        self.topology = get_topology(self.size)
 
         self.state_invalid = False
         self.state_solved = False
         self.invalid_index = (-1, -1)
         self.actions = actions
 
+        # Work queues of cells reduced to one candidate and of (unit, digit) keys whose count dropped to one
+        self.singles_queue = []
+        self.hidden_queue = []
+
+        # Deduction techniques tried once singles are exhausted, with the number of times each one fired
+        self.strategies = default_strategies if strategies is None else strategies
+        self.technique_hits = {}
+
+        # Undo log for in-place search, None when disabled. Eliminations are stored as idx * size + digit,
+        # placements as -1 - (idx * size + digit)
+        self.trail = None
+        self.branch_nodes = 0
+        # Search statistics: deepest level reached (kept by the search loops) and branches rolled back
+        self.max_depth = 0
+        self.backtracks = 0
+
+        # Deadline, node budget and cancel flag of the request (pulsar.Budget), checked at every branch node
+        self.budget = budget
+        self.state_cancelled = False
+
+        # Two equal singles in one unit of the loaded grid, propagation never looks at placed cells again
+        if self.cgrid.conflict is not None:
+            self.flag_invalid(self.cgrid.conflict)
+
         # self.ui_obj = ui_obj
 
+    @property
+    def grid(self):
+        """ Candidates in the list-of-lists format, e.g. grid[i][j] = [1, 4, 7] """
+        return self.cgrid.to_lists()
+
     def solve(self):
         if len(self.actions) > 0:
             self.apply_actions(self.actions)
@@ -24,135 +64,226 @@ class Solver:
             if self.state_invalid:
                 break
             else:
-                self.setval(action)
+                (i, j) = action['idx']
+                self.assign(i * self.size + j, 1 << (action['val'] - 1))
+        self.propagate()
 
     def is_valid(self, action):
         (i, j) = action['idx']
-        val = action['val']
-        for it in range(self.size):
-            if (len(self.grid[i][it]) <= 1) and (self.grid[i][it][0] == val) and (it != j):
-                return False
-            if (len(self.grid[it][j]) <= 1) and (self.grid[it][j][0] == val) and (it != i):
+        bit = 1 << (action['val'] - 1)
+        mask = self.cgrid.cells[i * self.size + j]
+
+        if not mask & bit:
+            return False
+        if mask == bit:
+            # A single candidate which is already placed in its unit belongs to this very cell
+            return True
+        return not self.cgrid.is_placed(i, j, bit)
+
+    def setval(self, action):
+        (x, y) = action['idx']
+        self.assign(x * self.size + y, 1 << (action['val'] - 1))
+        self.propagate()
+
+    def flag_invalid(self, idx):
+        self.state_invalid = True
+        if self.invalid_index == (-1, -1):
+            self.invalid_index = divmod(idx, self.size)
+        self.singles_queue = []
+        self.hidden_queue = []
+        return False
+
+    def assign(self, idx, bit):
+        """ Place a digit (as bit) in a cell and eliminate it from the peers, singles found are queued """
+        if self.state_invalid:
+            return False
+
+        cells = self.cgrid.cells
+        placed = self.cgrid.placed
+        mask = cells[idx]
+        (u1, u2, u3) = self.topology.cell_units[idx]
+
+        if not mask & bit:
+            return self.flag_invalid(idx)
+        if (placed[u1] | placed[u2] | placed[u3]) & bit:
+            if mask == bit:
+                return True
+            return self.flag_invalid(idx)
+
+        others = mask ^ bit
+        while others:
+            other = others & -others
+            others ^= other
+            if not self.eliminate(idx, other):
                 return False
-        it = i//self.rank
-        jt = j//self.rank
-        for i1 in range(it * self.rank, it * self.rank + self.rank):
-            for j1 in range(jt * self.rank, jt * self.rank + self.rank):
-                if ((len(self.grid[i1][j1]) <= 1) and
-                        (self.grid[i1][j1][0] == val) and (i1 != i) and (j1 != j)):
+
+        placed[u1] |= bit
+        placed[u2] |= bit
+        placed[u3] |= bit
+        if self.trail is not None:
+            self.trail.append(-1 - (idx * self.size + bit.bit_length() - 1))
+
+        for peer in self.topology.peers[idx]:
+            if cells[peer] & bit:
+                if not self.eliminate(peer, bit):
                     return False
         return True
 
-    def setval(self, action):
-        (x, y) = action['idx']
-        no = action['val']
+    def eliminate(self, idx, bit):
+        """ Remove a candidate from a cell, keeping the per-unit digit counts up to date """
+        cells = self.cgrid.cells
+        mask = cells[idx]
+        if not mask & bit:
+            return True
 
-        if not self.is_valid(action):
-            self.state_invalid = True
-            if self.invalid_index == (-1, -1):
-                self.invalid_index = (x, y)
-            return
+        mask ^= bit
+        cells[idx] = mask
+
+        counts = self.cgrid.counts
+        digit = bit.bit_length() - 1
+        if self.trail is not None:
+            self.trail.append(idx * self.size + digit)
+        exhausted = False
+        for unit in self.topology.cell_units[idx]:
+            key = unit * self.size + digit
+            counts[key] -= 1
+            if counts[key] == 1:
+                self.hidden_queue.append(key)
+            elif counts[key] == 0:
+                exhausted = True
+
+        if exhausted or not mask:
+            return self.flag_invalid(idx)
+        if not mask & (mask - 1):
+            self.singles_queue.append(idx)
+        return True
 
-        self.grid[x][y] = [no]
+    def propagate(self):
+        """ Assign queued naked and hidden singles until nothing changes or a contradiction shows up """
+        cells = self.cgrid.cells
+        placed = self.cgrid.placed
+        counts = self.cgrid.counts
+        units = self.topology.units
+        cell_units = self.topology.cell_units
 
-        relative_cells = self.getrelative_cells(x, y)
+        while not self.state_invalid:
+            if self.singles_queue:
+                idx = self.singles_queue.pop()
+                mask = cells[idx]
+                if not placed[cell_units[idx][0]] & mask:
+                    self.record_hit('naked_single')
+                    self.assign(idx, mask)
+            elif self.hidden_queue:
+                key = self.hidden_queue.pop()
+                unit, digit = divmod(key, self.size)
+                bit = 1 << digit
+                if (placed[unit] & bit) or (counts[key] != 1):
+                    continue
+                for idx in units[unit]:
+                    if cells[idx] & bit:
+                        self.record_hit('hidden_single')
+                        self.assign(idx, bit)
+                        break
+            else:
+                break
 
-        for t in relative_cells:
-            (i, j) = t
-            if len(self.grid[i][j]) > 2:
-                if self.grid[i][j].count(no) > 0:
-                    self.grid[i][j].remove(no)
-            elif len(self.grid[i][j]) == 2:
-                if self.grid[i][j].count(no) > 0:
-                    self.grid[i][j].remove(no)
-                    self.setval({'idx': (i, j), 'val': self.grid[i][j][0]})
+        return not self.state_invalid
 
     def apply_distinctive_iteration(self):
+        """ Queue the singles already present in the grid and propagate them """
+        cells = self.cgrid.cells
+        placed = self.cgrid.placed
+        counts = self.cgrid.counts
 
-        itercnt = 0
-        restart_iteration = True
-        while restart_iteration and (not self.state_invalid):
-            itercnt += 1
-
-            restart_iteration = False
-            for i in range(self.size):
-                for j in range(self.size):
-                    if len(self.grid[i][j]) > 1:
-                        for k in self.grid[i][j]:
-                            restart_iteration = self.unique_in_relative_cells(k, i, j)
-                            if restart_iteration:
-                                self.setval({'idx': (i, j), 'val': k})
-                                break
-                    if restart_iteration:
-                        break
-                if restart_iteration:
+        if not self.state_invalid:
+            for idx, mask in enumerate(cells):
+                if not mask:
+                    self.flag_invalid(idx)
                     break
+                if not (mask & (mask - 1)) and not (placed[self.topology.cell_units[idx][0]] & mask):
+                    self.singles_queue.append(idx)
 
-        self.state_solved = True
-        for i in range(self.size):
-            for j in range(self.size):
-                if len(self.grid[i][j]) > 1:
-                    self.state_solved = False
+        if not self.state_invalid:
+            for key, count in enumerate(counts):
+                if count == 1 and not (placed[key // self.size] & (1 << (key % self.size))):
+                    self.hidden_queue.append(key)
+            self.propagate()
+            self.apply_strategies()
 
-    def unique_in_relative_cells(self, val, x, y):
-        relative_cells = self.getrelative_cells(x, y)
-        relative_row_cells = []
-        relative_col_cells = []
-        relative_blk_cells = []
-
-        flag1, flag2, flag3 = True, True, True
-
-        for t in relative_cells:
-            (i, j) = t
-
-            if (i == x) and (self.grid[i][j].count(val) > 0):
-                flag1 = False
-
-            if (j == y) and (self.grid[i][j].count(val) > 0):
-                flag2 = False
-
-            if (int(x - x % self.rank) <= i <= int(x - x % self.size + self.size - 1) and
-                    int(y - y % self.size) <= j <= int(y - y % self.size + self.size - 1)):
-                if self.grid[i][j].count(val) > 0:
-                    flag3 = False
-
-        # for t in relative_row_cells:
-        #     i, j = t
-        #     if self.grid[i][j].count(val) > 0:
-        #         flag1 = False
-        #
-        # for t in relative_col_cells:
-        #     i, j = t
-        #     if self.grid[i][j].count(val) > 0:
-        #         flag2 = False
-        #
-        # for t in relative_blk_cells:
-        #     i, j = t
-        #     if self.grid[i][j].count(val) > 0:
-        #         flag3 = False
-
-        return flag1 | flag2 | flag3
+        self.state_solved = (not self.state_invalid) and self.cgrid.is_solved()
 
-    def getrelative_cells(self, x, y):
+    def apply_strategies(self):
+        """ Run the strategy pipeline, restarting from the cheapest technique after every hit """
+        progress = True
+        while progress and (not self.state_invalid) and (not self.cgrid.is_solved()):
+            progress = False
+            for name, strategy in self.strategies:
+                if strategy(self):
+                    self.record_hit(name)
+                    self.propagate()
+                    progress = True
+                    break
 
-        out = []
-        for t in range(self.size):
-            if t != x:
-                temp = (t, y)
-                out.append(temp)
-            if t != y:
-                temp = (x, t)
-                out.append(temp)
+    def apply_branch(self, actions):
+        """
+        Apply search decisions on top of an already propagated grid, recording changes on the trail.
+        Nothing is applied once the budget is exceeded, state_cancelled is set instead.
+        """
+        if (self.budget is not None) and self.budget.exceeded(self.branch_nodes):
+            self.state_cancelled = True
+            return
+        self.branch_nodes += 1
+        self.apply_actions(actions)
+        self.apply_strategies()
+        self.state_solved = (not self.state_invalid) and self.cgrid.is_solved()
 
-        x1, y1 = x - (x % self.rank), y - (y % self.rank)
+    def enable_trail(self):
+        self.trail = []
 
-        for i in range(x1, x1 + self.rank):
-            for j in range(y1, y1 + self.rank):
-                if i != x and j != y:
-                    temp = (i, j)
-                    out.append(temp)
+    def mark(self):
+        return len(self.trail)
 
-        return out
+    def undo(self, mark):
+        """ Roll the grid back to a trail mark, restoring candidates, counts and placed masks """
+        trail = self.trail
+        cells = self.cgrid.cells
+        placed = self.cgrid.placed
+        counts = self.cgrid.counts
+        cell_units = self.topology.cell_units
+        size = self.size
+
+        self.backtracks += 1
+        while len(trail) > mark:
+            entry = trail.pop()
+            if entry >= 0:
+                idx, digit = divmod(entry, size)
+                cells[idx] |= 1 << digit
+                for unit in cell_units[idx]:
+                    counts[unit * size + digit] += 1
+            else:
+                idx, digit = divmod(-1 - entry, size)
+                for unit in cell_units[idx]:
+                    placed[unit] &= ~(1 << digit)
+
+        self.state_invalid = False
+        self.state_solved = False
+        self.invalid_index = (-1, -1)
+        self.singles_queue = []
+        self.hidden_queue = []
+
+    def record_hit(self, technique):
+        self.technique_hits[technique] = self.technique_hits.get(technique, 0) + 1
+
+    def unique_in_relative_cells(self, val, x, y):
+        counts = self.cgrid.counts
+        digit = val - 1
+        for unit in self.topology.cell_units[x * self.size + y]:
+            if counts[unit * self.size + digit] == 1:
+                return True
+        return False
+
+    def getrelative_cells(self, x, y):
+        return self.topology.peer_cells[x * self.size + y]
 
     def print_solution(self, grid=None):
         if grid:
@@ -0,0 +1,41 @@
+from functools import lru_cache
+
+
+class Topology:
+    """
+    Static structure of an N x N grid: units and peers of every cell as flat (row-major) indices.
+    It depends only on the grid size, so it is built once per size and shared by every solver.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.rank = int(size**0.5)
+        cell_count = size * size
+
+        self.row_of = tuple(idx // size for idx in range(cell_count))
+        self.col_of = tuple(idx % size for idx in range(cell_count))
+        self.box_of = tuple((idx // size // self.rank) * self.rank + (idx % size) // self.rank
+                            for idx in range(cell_count))
+
+        self.rows = tuple(tuple(range(r * size, (r + 1) * size)) for r in range(size))
+        self.cols = tuple(tuple(range(c, cell_count, size)) for c in range(size))
+        self.boxes = tuple(tuple(idx for idx in range(cell_count) if self.box_of[idx] == b) for b in range(size))
+
+        # Units are numbered rows first, then columns, then boxes
+        self.units = self.rows + self.cols + self.boxes
+        self.cell_units = tuple((self.row_of[idx], size + self.col_of[idx], 2 * size + self.box_of[idx])
+                                for idx in range(cell_count))
+
+        # Other cells of the row, column and box of every cell
+        self.row_peers = tuple(tuple(x for x in self.rows[self.row_of[idx]] if x != idx) for idx in range(cell_count))
+        self.col_peers = tuple(tuple(x for x in self.cols[self.col_of[idx]] if x != idx) for idx in range(cell_count))
+        self.box_peers = tuple(tuple(x for x in self.boxes[self.box_of[idx]] if x != idx)
+                               for idx in range(cell_count))
+
+        self.peers = tuple(tuple(sorted(set(self.row_peers[idx] + self.col_peers[idx] + self.box_peers[idx])))
+                           for idx in range(cell_count))
+        self.peer_cells = tuple(tuple(divmod(x, size) for x in self.peers[idx]) for idx in range(cell_count))
+
+
+@lru_cache(maxsize=None)
+def get_topology(size):
+    return Topology(size)
@@ -0,0 +1,131 @@
+from base64 import b64decode, b64encode
+from binascii import Error as Base64Error
+
+
+# Encodings of puzzles and solutions on the wire, negotiated per request with 'format' (the puzzle) and
+# 'output' (the solution, same as 'format' unless set):
+#   lists    nested rows, empty cells None or 0; solutions as rows of single element lists (the legacy format)
+#   flat     the N*N cells row by row as one list of ints, 0 for empty cells
+#   string   one character per cell, digits then letters (base 36, so up to 35x35), '.', '0' or '-' for empty
+#   binary   packed bytes: the size, then every cell in size.bit_length() bits, big endian and zero padded;
+#            base64 in JSON, raw bytes in Socket.IO events
+wire_formats = ('lists', 'flat', 'string', 'binary')
+string_digits = '123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+string_empty = '.0-'
+
+
+def grid_size(count):
+    """ Side of a square grid of count cells, ValueError unless it is a valid sudoku size """
+    size = int(round(count**0.5))
+    rank = int(round(size**0.5))
+    if size == 0 or size * size != count or rank * rank != size:
+        raise ValueError(f"{count} cells do not make a sudoku grid")
+    return size
+
+
+def check_format(fmt, size):
+    """ ValueError unless fmt is a wire format that can encode a grid of the size """
+    if fmt not in wire_formats:
+        raise ValueError(f"Unknown wire format {fmt}")
+    if fmt == 'string' and size > len(string_digits):
+        raise ValueError(f"Wire format string encodes grids up to {len(string_digits)}x{len(string_digits)}")
+    if fmt == 'binary' and size > 255:
+        raise ValueError("Wire format binary encodes grids up to 255x255")
+
+
+def to_rows(cells, size):
+    """ Row lists of a flat list of cells, 0 becomes None """
+    return [[cell or None for cell in cells[i * size:(i + 1) * size]] for i in range(size)]
+
+
+def decode_puzzle(data, fmt='lists'):
+    """ Puzzle in the list-of-lists format (None for empty cells) from its wire encoding, ValueError if invalid """
+    if fmt == 'lists':
+        if any(len(row) != len(data) for row in data):
+            raise ValueError("Puzzle is not square")
+        cells = [cell for row in data for cell in row]
+    elif fmt == 'flat':
+        cells = list(data)
+    elif fmt == 'string':
+        cells = [0 if char in string_empty else string_digits.index(char.upper()) + 1 for char in data]
+    elif fmt == 'binary':
+        return unpack(data)
+    else:
+        raise ValueError(f"Unknown wire format {fmt}")
+
+    size = grid_size(len(cells))
+    if not all(cell is None or (isinstance(cell, int) and 0 <= cell <= size) for cell in cells):
+        raise ValueError("Cell values out of range")
+    return to_rows(cells, size)
+
+
+def encode_solution(solution, fmt='lists'):
+    """
+    Wire encoding of a solution (or puzzle) in the list-of-lists format, None stays None. ValueError when the
+    format cannot encode a grid of its size (see check_format).
+    """
+    if solution is None or fmt == 'lists':
+        return solution
+    check_format(fmt, len(solution))
+
+    cells = [(cell[0] if len(cell) == 1 else 0) if isinstance(cell, list) else (cell or 0)
+             for row in solution for cell in row]
+    if fmt == 'flat':
+        return cells
+    if fmt == 'string':
+        return ''.join(string_digits[cell - 1] if cell else '.' for cell in cells)
+    return pack(cells, len(solution))
+
+
+def encode_payload(payload, binary=bytes):
+    """
+    Payload with its solution in the wire format the payload was tagged with ('format'), untagged payloads
+    are left in the list-of-lists format. binary converts packed solutions, to_base64 for JSON responses.
+    """
+    fmt = payload.get('format')
+    if fmt is None or fmt == 'lists':
+        return payload
+    solution = encode_solution(payload.get('solution'), fmt)
+    if fmt == 'binary' and solution is not None:
+        solution = binary(solution)
+    return dict(payload, solution=solution)
+
+
+def to_base64(data):
+    return b64encode(data).decode('ascii')
+
+
+def pack(cells, size):
+    width = size.bit_length()
+    bits = width * len(cells)
+    value = 0
+    for cell in cells:
+        value = (value << width) | cell
+    value <<= -bits % 8
+    return bytes([size]) + value.to_bytes((bits + 7) // 8, 'big')
+
+
+def unpack(data):
+    """ Puzzle of a packed binary encoding, as raw bytes or base64 """
+    if isinstance(data, str):
+        try:
+            data = b64decode(data, validate=True)
+        except Base64Error:
+            raise ValueError("Invalid base64")
+    if not data:
+        raise ValueError("Empty binary puzzle")
+
+    size = data[0]
+    count = size * size
+    grid_size(count)
+    width = size.bit_length()
+    bits = width * count
+    if len(data) != 1 + (bits + 7) // 8:
+        raise ValueError("Binary puzzle length does not match its size")
+
+    value = int.from_bytes(data[1:], 'big') >> (-bits % 8)
+    mask = (1 << width) - 1
+    cells = [(value >> (width * (count - 1 - k))) & mask for k in range(count)]
+    if any(cell > size for cell in cells):
+        raise ValueError("Cell values out of range")
+    return to_rows(cells, size)
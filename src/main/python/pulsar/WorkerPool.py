@@ -0,0 +1,70 @@
+from multiprocessing import Process, Queue
+from queue import Full
+
+from pulsar.Budget import Budget
+from pulsar.SATSolver import get_warm_solver
+from pulsar.tools import run_solver
+
+
+sat_workers = 2
+sat_queue_size = 64
+sat_warm_sizes = (9, 16)
+
+
+class SATWorkerPool:
+    """
+    Long-lived SAT worker processes fed from a bounded job queue. Every worker loads the base encodings of
+    the warm sizes once at start up and keeps one solver per grid size, so a request only pays for solving.
+    When the job queue is full, submit refuses the job instead of piling up work (backpressure).
+    The workers inherit the cancel flags (CancelTable.flags) used by the budgets of the jobs.
+    """
+    def __init__(self, response_queue, cancel_flags=None, processes=sat_workers, queue_size=sat_queue_size,
+                 warm_sizes=sat_warm_sizes):
+        self.response_queue = response_queue
+        self.job_queue = Queue(maxsize=queue_size)
+        self.workers = []
+
+        for _ in range(processes):
+            p = Process(target=sat_worker, args=(self.job_queue, self.response_queue, warm_sizes, cancel_flags),
+                        daemon=True)
+            p.start()
+            self.workers.append(p)
+
+    def submit(self, puzzle, session_id, encoding='naive', amo='pairwise', budget=None, timeout=None,
+               profile=False, output=None):
+        """
+        Queue a puzzle, returns False when the queue stays full for timeout seconds (None: don't wait).
+        profile and output are passed on to run_solver
+        """
+        limits = budget.limits() if budget is not None else None
+        try:
+            self.job_queue.put((puzzle, session_id, encoding, amo, limits, profile, output),
+                               block=timeout is not None, timeout=timeout)
+        except Full:
+            return False
+        return True
+
+    def close(self):
+        for _ in self.workers:
+            self.job_queue.put(None)
+        for p in self.workers:
+            p.join()
+        self.workers = []
+
+
+def sat_worker(job_queue, response_queue, warm_sizes, cancel_flags=None):
+    for size in warm_sizes:
+        get_warm_solver([[None] * size for _ in range(size)])
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        (puzzle, session_id, encoding, amo, limits, profile, output) = job
+        budget = None
+        if limits is not None:
+            (deadline, max_nodes, slot) = limits
+            budget = Budget(deadline, max_nodes, cancel_flags, slot)
+        run_solver(puzzle, response_queue, session_id, 'SAT', encoding=encoding, amo=amo, budget=budget,
+                   profile=profile, output=output)
@@ -0,0 +1,98 @@
+from random import Random
+
+from pulsar.CandidateGrid import popcount, mask_to_digits
+
+
+class Branching:
+    """
+    Branching heuristic of the backtracking search: which cell to branch on and in which order to try its digits.
+
+    cell_order:  'mrv' picks a cell with the fewest candidates, 'mrv_degree' breaks ties by the number of
+                 unsolved peers (most constrained first)
+    value_order: 'natural', 'lcv' (least constraining value first, i.e. the digit held by the fewest
+                 unsolved peers) or 'random'
+    restarts:    number of randomized restarts, every run before the last one gives up after restart_nodes
+                 branch nodes (growing by restart_growth each run) and ties are broken at random
+    """
+    def __init__(self, cell_order='mrv_degree', value_order='natural', restarts=0, restart_nodes=200,
+                 restart_growth=2, seed=None):
+        self.cell_order = cell_order
+        self.value_order = value_order
+        self.restarts = restarts
+        self.restart_nodes = restart_nodes
+        self.restart_growth = restart_growth
+        self.rng = Random(seed)
+
+    def select_cell(self, cgrid):
+        cells = cgrid.cells
+        peers = cgrid.topology.peers
+        randomize = self.restarts > 0
+
+        best_idx, best_count, best_degree, ties = -1, cgrid.size + 1, -1, 0
+        for idx, mask in enumerate(cells):
+            if not mask & (mask - 1):
+                continue
+
+            count = popcount(mask)
+            if count > best_count:
+                continue
+
+            degree = 0
+            if self.cell_order == 'mrv_degree':
+                for peer in peers[idx]:
+                    if cells[peer] & (cells[peer] - 1):
+                        degree += 1
+
+            if (count < best_count) or (degree > best_degree):
+                best_idx, best_count, best_degree, ties = idx, count, degree, 1
+            elif degree == best_degree and randomize:
+                # Reservoir sampling over equally ranked cells
+                ties += 1
+                if self.rng.randrange(ties) == 0:
+                    best_idx = idx
+
+            if count == 2 and self.cell_order == 'mrv' and not randomize:
+                break
+
+        return best_idx
+
+    def order_values(self, cgrid, idx):
+        digits = mask_to_digits(cgrid.cells[idx])
+
+        if self.value_order == 'lcv':
+            cells = cgrid.cells
+            peers = cgrid.topology.peers[idx]
+            impact = {}
+            for val in digits:
+                bit = 1 << (val - 1)
+                impact[val] = sum(1 for peer in peers if (cells[peer] & bit) and (cells[peer] & (cells[peer] - 1)))
+            digits.sort(key=lambda val: impact[val])
+        elif self.value_order == 'random':
+            self.rng.shuffle(digits)
+
+        return digits
+
+    def get_next_set_of_actions(self, cgrid):
+        idx = self.select_cell(cgrid)
+        if idx < 0:
+            return []
+
+        cell = divmod(idx, cgrid.size)
+        return [[{'idx': cell, 'val': val}] for val in self.order_values(cgrid, idx)]
+
+
+branching_heuristics = {
+    'mrv': dict(cell_order='mrv'),
+    'mrv_degree': dict(cell_order='mrv_degree'),
+    'mrv_lcv': dict(cell_order='mrv_degree', value_order='lcv'),
+    'restarts': dict(cell_order='mrv_degree', value_order='random', restarts=8),
+}
+
+
+def get_heuristic(name=None):
+    """ Branching heuristic by name, None for the legacy step based cell choice of tools.get_backtracking_elements """
+    if name is None or name == 'legacy':
+        return None
+    if isinstance(name, Branching):
+        return name
+    return Branching(**branching_heuristics[name])
@@ -0,0 +1,189 @@
+from functools import partial
+from itertools import combinations
+
+from pulsar.CandidateGrid import popcount
+
+
+# Human-style deduction techniques run by Solver once singles are exhausted.
+# Every strategy takes the solver, removes candidates through solver.eliminate (so the unit counts and
+# the singles queues stay in sync) and returns True if it eliminated anything.
+
+
+def locked_candidates(solver):
+    """ Pointing (box confined to a line) and claiming (line confined to a box) """
+    size = solver.size
+    rank = solver.rank
+    topology = solver.topology
+    cells = solver.cgrid.cells
+    placed = solver.cgrid.placed
+    counts = solver.cgrid.counts
+    changed = False
+
+    for unit in range(3 * size):
+        for digit in range(size):
+            bit = 1 << digit
+            if (placed[unit] & bit) or not (2 <= counts[unit * size + digit] <= rank):
+                continue
+
+            holders = [idx for idx in topology.units[unit] if cells[idx] & bit]
+            if unit >= 2 * size:
+                # Pointing: all candidates of the box lie on one row or column
+                targets = []
+                if len({topology.row_of[idx] for idx in holders}) == 1:
+                    targets.append(topology.rows[topology.row_of[holders[0]]])
+                if len({topology.col_of[idx] for idx in holders}) == 1:
+                    targets.append(topology.cols[topology.col_of[holders[0]]])
+                box = unit - 2 * size
+                exclude = lambda idx: topology.box_of[idx] == box
+            else:
+                # Claiming: all candidates of the row/column lie in one box
+                targets = []
+                if len({topology.box_of[idx] for idx in holders}) == 1:
+                    targets.append(topology.boxes[topology.box_of[holders[0]]])
+                line_cells = set(topology.units[unit])
+                exclude = lambda idx: idx in line_cells
+
+            for target in targets:
+                for idx in target:
+                    if (cells[idx] & bit) and not exclude(idx):
+                        changed = True
+                        if not solver.eliminate(idx, bit):
+                            return True
+    return changed
+
+
+def naked_subsets(solver, subset_size):
+    """ subset_size cells of a unit sharing exactly subset_size candidates (pairs, triples, quads) """
+    cells = solver.cgrid.cells
+    changed = False
+
+    for unit_cells in solver.topology.units:
+        unsolved = [idx for idx in unit_cells if cells[idx] & (cells[idx] - 1)]
+        if len(unsolved) <= subset_size:
+            continue
+        candidates = [idx for idx in unsolved if popcount(cells[idx]) <= subset_size]
+
+        for combo in combinations(candidates, subset_size):
+            union = 0
+            for idx in combo:
+                union |= cells[idx]
+            if popcount(union) != subset_size:
+                continue
+
+            for idx in unsolved:
+                if (idx not in combo) and (cells[idx] & union):
+                    changed = True
+                    if not eliminate_mask(solver, idx, cells[idx] & union):
+                        return True
+    return changed
+
+
+def hidden_subsets(solver, subset_size):
+    """ subset_size digits of a unit confined to exactly subset_size cells (pairs, triples, quads) """
+    size = solver.size
+    cells = solver.cgrid.cells
+    placed = solver.cgrid.placed
+    counts = solver.cgrid.counts
+    changed = False
+
+    for unit, unit_cells in enumerate(solver.topology.units):
+        # Positions (within the unit) of every open digit that could belong to a subset
+        positions = {}
+        for digit in range(size):
+            bit = 1 << digit
+            if not (placed[unit] & bit) and (2 <= counts[unit * size + digit] <= subset_size):
+                pos = 0
+                for k, idx in enumerate(unit_cells):
+                    if cells[idx] & bit:
+                        pos |= 1 << k
+                positions[digit] = pos
+
+        if len(positions) < subset_size:
+            continue
+
+        for combo in combinations(positions, subset_size):
+            pos_union = 0
+            digit_mask = 0
+            for digit in combo:
+                pos_union |= positions[digit]
+                digit_mask |= 1 << digit
+            if popcount(pos_union) != subset_size:
+                continue
+
+            for k, idx in enumerate(unit_cells):
+                if (pos_union >> k) & 1 and (cells[idx] & ~digit_mask):
+                    changed = True
+                    if not eliminate_mask(solver, idx, cells[idx] & ~digit_mask):
+                        return True
+    return changed
+
+
+def fish(solver, fish_size):
+    """ Basic fish on one digit: X-Wing (fish_size 2) and Swordfish (fish_size 3) """
+    size = solver.size
+    topology = solver.topology
+    cells = solver.cgrid.cells
+    placed = solver.cgrid.placed
+    counts = solver.cgrid.counts
+    changed = False
+
+    for digit in range(size):
+        bit = 1 << digit
+        # Base sets are rows with columns as cover sets, then the other way around
+        for base_lines, cover_lines, base_offset in ((topology.rows, topology.cols, 0),
+                                                     (topology.cols, topology.rows, size)):
+            positions = {}
+            for line, line_cells in enumerate(base_lines):
+                unit = base_offset + line
+                if not (placed[unit] & bit) and (2 <= counts[unit * size + digit] <= fish_size):
+                    pos = 0
+                    for k, idx in enumerate(line_cells):
+                        if cells[idx] & bit:
+                            pos |= 1 << k
+                    positions[line] = pos
+
+            if len(positions) < fish_size:
+                continue
+
+            for combo in combinations(positions, fish_size):
+                pos_union = 0
+                for line in combo:
+                    pos_union |= positions[line]
+                if popcount(pos_union) != fish_size:
+                    continue
+
+                for k in range(size):
+                    if not (pos_union >> k) & 1:
+                        continue
+                    for line, idx in enumerate(cover_lines[k]):
+                        if (line not in combo) and (cells[idx] & bit):
+                            changed = True
+                            if not solver.eliminate(idx, bit):
+                                return True
+    return changed
+
+
+def eliminate_mask(solver, idx, mask):
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        if not solver.eliminate(idx, bit):
+            return False
+    return True
+
+
+# Ordered from cheapest to most expensive, the pipeline restarts from the top after every hit
+default_strategies = [
+    ('locked_candidates', locked_candidates),
+    ('naked_pairs', partial(naked_subsets, subset_size=2)),
+    ('hidden_pairs', partial(hidden_subsets, subset_size=2)),
+    ('naked_triples', partial(naked_subsets, subset_size=3)),
+    ('hidden_triples', partial(hidden_subsets, subset_size=3)),
+    ('x_wing', partial(fish, fish_size=2)),
+    ('naked_quads', partial(naked_subsets, subset_size=4)),
+    ('hidden_quads', partial(hidden_subsets, subset_size=4)),
+    ('swordfish', partial(fish, fish_size=3)),
+]
+
+# Cheaper subset for the nodes of a backtracking search, where the pipeline runs once per branch
+search_strategies = default_strategies[:3]
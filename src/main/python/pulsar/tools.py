@@ -1,31 +1,56 @@
+import logging
 from itertools import product
-from copy import deepcopy
 from datetime import datetime
-from multiprocessing import Pool, Manager
+from random import sample
+from queue import Empty, SimpleQueue as LocalQueue
+from multiprocessing import Process, Queue, RawArray, RawValue, Value, cpu_count
 
 from pulsar.Solver import Solver
-from pulsar.SATSolver import SATSolver
+from pulsar.CandidateGrid import CandidateGrid, popcount, mask_to_digits
+from pulsar.SATSolver import SATSolver, get_warm_solver
+from pulsar.DLXSolver import DLXSolver
+from pulsar.GridSlab import GridSlab
+from pulsar.Budget import Budget
+from pulsar.strategies import search_strategies
+from pulsar.heuristics import get_heuristic
+from pulsar.Portfolio import Portfolio
+from pulsar.Metrics import SearchStats
+from pulsar.Profiling import profile_solver
 
 
+logger = logging.getLogger(__name__)
+
+# Search depth cap, never below the number of cells (a 25x25 grid can need more than 300 decisions)
 backtracking_depth_max = 300
 backtracking_step = 1
 parallel_processes_max = 10
+parallel_units_per_worker = 4
+parallel_split_depth = 6
+parallel_spare_slots = 8
+# Seconds between the checks of the budget and of the worker processes while waiting for their results
+result_poll_interval = 0.05
+default_heuristic = 'mrv_lcv'
+# Cancel flags of the batch pool workers, set by init_batch_worker
+batch_cancel_flags = None
 
 
 def get_backtracking_elements(grid, step):
     elements = []
-    grid_size = len(grid)
+    grid_size = grid.size
+    cells = grid.cells
     for size in range(2, (grid_size + 1)):
-        for i in range(grid_size):
-            for j in range(grid_size):
-                if (len(grid[i][j]) > 1) and (len(grid[i][j]) <= size):
-                    elements.append({'idx': (i, j), 'vals': grid[i][j]})
-                    if len(elements) >= step:
-                        return elements
+        for idx in range(grid_size * grid_size):
+            if (cells[idx] & (cells[idx] - 1)) and (popcount(cells[idx]) <= size):
+                elements.append({'idx': divmod(idx, grid_size), 'vals': mask_to_digits(cells[idx])})
+                if len(elements) >= step:
+                    return elements
     return elements
 
 
-def get_next_set_of_actions(tempgrid, step):
+def get_next_set_of_actions(tempgrid, step, heuristic=None):
+    if heuristic is not None:
+        return heuristic.get_next_set_of_actions(tempgrid)
+
     elements = get_backtracking_elements(tempgrid, step)
 
     iter_element_indices = [x['idx'] for x in elements]
@@ -50,7 +75,7 @@ def get_actions_from_question(puzzle):
                 action = {'idx': (i, j), 'val': puzzle[i][j]}
                 actions.append(action)
 
-    grid = [[[z+1 for z in range(size)] for _ in range(size)] for _ in range(size)]
+    grid = CandidateGrid(size)
     return grid, actions
 
 
@@ -62,239 +87,707 @@ def simple_solve(puzzle):
     solver.solve()
 
     if solver.state_invalid:
-        print("Puzzle Invalid!")
+        logger.debug("Puzzle Invalid!")
 
     return solver
 
 
-def apply_backtracking(grid, depth=1):
+def apply_backtracking(grid, depth=1, heuristic=default_heuristic, budget=None):
+
+    if not isinstance(grid, CandidateGrid):
+        grid = CandidateGrid.from_lists(grid)
+    heuristic = get_heuristic(heuristic)
+
+    solver = Solver(grid.copy(), strategies=search_strategies, budget=budget)
+    solver.solve()
+
+    if (not solver.state_solved) and (not solver.state_invalid):
+        solver.enable_trail()
+
+        # Randomized restarts give up after a growing number of branch nodes, the last run is unbounded
+        restarts = heuristic.restarts if heuristic is not None else 0
+        node_limit = heuristic.restart_nodes if restarts else None
+        for _ in range(restarts):
+            if backtrack(solver, depth, heuristic, solver.branch_nodes + node_limit) is not None:
+                return solver
+            if solver.state_cancelled:
+                return solver
+            node_limit *= heuristic.restart_growth
+
+        backtrack(solver, depth, heuristic)
+
+    return solver
+
 
-    actions_list = get_next_set_of_actions(grid, step=backtracking_step)
-    solver = None
+def backtrack(solver, depth, heuristic=None, node_limit=None):
+    """
+    Depth first search in place, every branch is rolled back from the solver trail instead of copying the grid.
+    Returns True once solved, False when the subtree is exhausted and None when node_limit is reached or the
+    solver budget is exceeded (solver.state_cancelled).
+    """
+    if depth > solver.max_depth:
+        solver.max_depth = depth
+    actions_list = get_next_set_of_actions(solver.cgrid, step=backtracking_step, heuristic=heuristic)
     for actions in actions_list:
-        solver = Solver(deepcopy(grid), actions)
-        solver.solve()
+        if (node_limit is not None) and (solver.branch_nodes >= node_limit):
+            return None
 
+        mark = solver.mark()
+        solver.apply_branch(actions)
+
+        if solver.state_cancelled:
+            return None
         if solver.state_solved:
-            return solver
+            return True
 
-        # print(f"Depth= {depth}, Action - {actions} - valid? - { not solver.state_invalid}")
         if not solver.state_invalid:
-            if depth <= backtracking_depth_max:
-                solver = apply_backtracking(deepcopy(solver.grid), depth + 1)
-                if solver.state_solved:
-                    return solver
+            if depth <= max(backtracking_depth_max, solver.size * solver.size):
+                result = backtrack(solver, depth + 1, heuristic, node_limit)
+                if result is None:
+                    solver.undo(mark)
+                    return None
+                if result:
+                    return True
             else:
-                print("Depth exceeded")
+                logger.warning("Depth exceeded")
 
-    return solver
+        solver.undo(mark)
 
+    return False
+
+
+def count_backtrack(solver, heuristic=None, limit=None, depth=1):
+    """
+    Number of solutions below the current node of an in-place search: the trail based search of backtrack,
+    continued past every solution. Stops once limit solutions are counted, or with solver.state_cancelled set
+    when the budget is exceeded.
+    """
+    if depth > solver.max_depth:
+        solver.max_depth = depth
+    count = 0
+    actions_list = get_next_set_of_actions(solver.cgrid, step=backtracking_step, heuristic=heuristic)
+    for actions in actions_list:
+        mark = solver.mark()
+        solver.apply_branch(actions)
 
-def sequential_solver(puzzle, response_queue, session_id):
+        if solver.state_cancelled:
+            return count
+        if solver.state_solved:
+            count += 1
+        elif not solver.state_invalid:
+            count += count_backtrack(solver, heuristic, None if limit is None else limit - count, depth + 1)
+            if solver.state_cancelled:
+                return count
+
+        solver.undo(mark)
+        if (limit is not None) and count >= limit:
+            break
+
+    return count
+
+
+def count_solutions(puzzle, limit=2, solver=None, heuristic=default_heuristic, encoding='naive', amo='pairwise',
+                    budget=None, thresholds=None):
+    """
+    Number of solutions of the puzzle, the search stops as soon as limit solutions are found (None counts all
+    of them). The givens are propagated first, then the rest is counted by the engine selected by name:
+    'sequential' (default, trail based search), 'DLX', 'SAT' (solutions blocked one by one under assumptions)
+    or 'auto' (sequential for easy puzzles, SAT for hard ones, scored as by the auto solver mode).
+
+    Returns {'count', 'exact': the search space was exhausted so count is the exact number,
+    'unique': True / False, None while undecided (budget exceeded, or limit 1), 'cancelled', 'engine',
+    'duration', 'stats'}
+    """
+    stt_time = datetime.now()
+    stats = SearchStats()
+    with stats.phase('propagation'):
+        propagated = simple_solve(puzzle)
+    stats.add_solver(propagated)
+
+    engine = 'propagation'
+    count, cancelled = (0 if propagated.state_invalid else 1), False
+    if (not propagated.state_invalid) and (not propagated.state_solved):
+        engine = solver if solver in ('DLX', 'SAT') else 'sequential'
+        if solver == 'auto':
+            portfolio = Portfolio(thresholds)
+            plan = portfolio.choose(propagated.size, portfolio.difficulty(propagated.cgrid))
+            engine = 'sequential' if plan == 'backtracking' else 'SAT'
+
+        with stats.phase('search'):
+            if engine == 'SAT':
+                counter = SATSolver(puzzle, encoding=encoding, amo=amo)
+                count = counter.count_solutions(limit, budget)
+                stats.add_sat(counter)
+            elif engine == 'DLX':
+                counter = DLXSolver(puzzle, propagated.cgrid, budget=budget)
+                count = counter.count_solutions(limit)
+                stats.add_dlx(counter)
+            else:
+                counter = Solver(propagated.cgrid, strategies=search_strategies, budget=budget)
+                counter.enable_trail()
+                count = count_backtrack(counter, get_heuristic(heuristic), limit)
+                stats.add_solver(counter)
+        cancelled = counter.state_cancelled
+
+    exact = (not cancelled) and (engine == 'propagation' or (limit is None) or count < limit)
+    unique = None
+    if count > 1 or (exact and count == 0):
+        unique = False
+    elif exact and count == 1:
+        unique = True
+
+    return {'count': count,
+            'exact': exact,
+            'unique': unique,
+            'cancelled': cancelled,
+            'engine': engine,
+            'duration': (datetime.now() - stt_time).total_seconds(),
+            'stats': dict(stats.to_dict(), engine=engine)}
+
+
+def sequential_solver(puzzle, response_queue, session_id, heuristic=default_heuristic, budget=None):
     stt_time = datetime.now()
-    print("")
-    print("Sequential Solver invoked!")
-    solver = simple_solve(puzzle)
-    print("Distinctive iterations done")
+    stats = SearchStats('sequential')
+    logger.debug("Sequential Solver invoked!")
+    with stats.phase('propagation'):
+        solver = simple_solve(puzzle)
+    stats.add_solver(solver)
 
     if (not solver.state_invalid) and (not solver.state_solved):
-        print("Simple Solve not enough, applying backtracking..")
-        solver = apply_backtracking(solver.grid)
-        print("Backtracking iterations done")
-
-    if solver.state_solved:
-        print("Solution Found!")
-        payload = {'solution': solver.grid,
-                   'duration': (datetime.now() - stt_time).total_seconds(),
-                   'session': session_id}
-    else:
-        payload = {'solution': None,
-                   'duration': (datetime.now() - stt_time).total_seconds(),
-                   'session': session_id}
-        print("Could not find solution!!")
+        logger.debug("Simple Solve not enough, applying backtracking..")
+        with stats.phase('search'):
+            solver = apply_backtracking(solver.cgrid, heuristic=heuristic, budget=budget)
+        stats.add_solver(solver)
+        if solver.state_cancelled:
+            logger.debug("Search stopped, budget exceeded or request cancelled")
+
+    payload = {'solution': solver.grid if solver.state_solved else None,
+               'duration': (datetime.now() - stt_time).total_seconds(),
+               'session': session_id,
+               'stats': stats.to_dict()}
+    if not solver.state_solved:
+        logger.debug("Could not find solution!!")
     del solver
 
     try:
         response_queue.put(payload)
     except ValueError:
-        print(f"Error occurred while loading response queue")
+        logger.error("Error occurred while loading response queue")
 
 
-def parallel_solver(puzzle, response_queue, session_id):
+def parallel_solver(puzzle, response_queue, session_id, heuristic=default_heuristic, budget=None):
 
     stt_time = datetime.now()
-    print("")
-    print("Parallel Solver invoked!")
-    solver = simple_solve(puzzle)
-    print("Distinctive iterations done")
+    stats = SearchStats('parallel')
+    with stats.phase('propagation'):
+        solver = simple_solve(puzzle)
+    stats.add_solver(solver)
+
+    solution = None
     if solver.state_solved:
-        print("Solution Found!")
+        solution = solver.grid
+    elif not solver.state_invalid:
+        with stats.phase('search'):
+            solution = parallel_search(solver.cgrid, heuristic, budget=budget, stats=stats)
+
+    if solution is None:
+        logger.debug("Could not find solution!!")
+
+    payload = {'solution': solution,
+               'duration': (datetime.now() - stt_time).total_seconds(),
+               'session': session_id,
+               'stats': stats.to_dict()}
+    try:
+        response_queue.put(payload)
+    except ValueError:
+        logger.error("Error occurred while loading response queue")
+
+
+def parallel_search(cgrid, heuristic=default_heuristic, processes=None, budget=None, stats=None):
+    """
+    Work stealing search over a propagated grid, returns the solution in the list-of-lists format or None.
+
+    The top of the search tree is split into work units, i.e. propagated grid states kept in a shared
+    memory GridSlab; only slot indices travel through the queues. Every worker process owns a queue of
+    units, pops from it and steals from the others when it runs dry. Busy workers hand the untried
+    siblings of their current node over (as one more slot) when some worker is idle. A shared flag cancels
+    everybody once a solution is found, and all results come back to the coordinator through one queue,
+    which it polls (see wait_result), so the deadline and crashed workers stop the search too. Every
+    worker checks the budget (its share of the node budget) at each node and reports back when it is
+    exceeded, which stops the search as well. The search statistics of the split and of every finished
+    unit are added to stats when given.
+    """
+    processes = processes or min(parallel_processes_max, cpu_count())
+    stats = stats if stats is not None else SearchStats()
+
+    root = Solver(cgrid.copy(), strategies=search_strategies, budget=budget)
+    root.solve()
+    if root.state_solved or root.state_invalid:
+        stats.add_solver(root)
+        return root.grid if root.state_solved else None
+    root.enable_trail()
+
+    (units, solution) = split_work(root, heuristic, processes * parallel_units_per_worker)
+    stats.add_solver(root)
+    if solution is not None:
+        return solution
+    if (not units) or root.state_cancelled:
+        return None
+
+    # Slots 0..processes-1 are reserved for the solutions, then the split units, then spare slots for donations
+    slab = GridSlab(cgrid.size, processes + len(units) + parallel_spare_slots * processes)
+    queues = [Queue() for _ in range(processes)]
+    free_slots = Queue()
+    for k, cells in enumerate(units):
+        slot = processes + k
+        slab.write(slot, cells)
+        queues[k % processes].put(slot)
+    for slot in range(processes + len(units), slab.slots):
+        free_slots.put(slot)
+
+    results = Queue()
+    cancel = RawValue('b', 0)
+    idle = Value('i', 0)
+
+    worker_budget = budget.split(processes) if budget is not None else None
+    workers = [Process(target=parallel_worker,
+                       args=(slab, heuristic, k, queues, free_slots, results, cancel, idle, worker_budget),
+                       daemon=True)
+               for k in range(processes)]
+    for p in workers:
+        p.start()
+
+    pending = len(units)
+    while pending > 0:
+        message = wait_result(results, workers, budget)
+        if message is None:
+            break
+        (kind, value, unit_stats) = message
+        if unit_stats is not None:
+            stats.add(unit_stats)
+        if kind == 'solution':
+            solution = CandidateGrid.from_cells(cgrid.size, slab.read(value)).to_lists()
+            break
+        elif kind == 'stopped':
+            logger.debug("Search stopped, budget exceeded or request cancelled")
+            break
+        elif kind == 'spawned':
+            pending += value
+        else:
+            pending -= 1
+
+    cancel.value = 1
+    for p in workers:
+        p.join(timeout=1)
+        if p.is_alive():
+            p.terminate()
+    slab.close()
+
+    return solution
+
+
+def split_work(solver, heuristic, target):
+    """
+    Expand the search tree breadth first until there are at least target open subtrees (or the split depth
+    is reached). Returns the propagated cells of every open subtree and the solution grid if one turns up
+    while splitting.
+    """
+    heuristic = get_heuristic(heuristic)
+    frontier = [([], solver.cgrid.cells[:])]
+    for level in range(parallel_split_depth):
+        if len(frontier) >= target:
+            break
+        solver.max_depth = level + 1
+
+        expanded = []
+        for (path, _) in frontier:
+            mark = solver.mark()
+            for actions in path:
+                solver.apply_branch(actions)
+
+            for actions in get_next_set_of_actions(solver.cgrid, step=backtracking_step, heuristic=heuristic):
+                branch_mark = solver.mark()
+                solver.apply_branch(actions)
+                if solver.state_cancelled:
+                    return [], None
+                if solver.state_solved:
+                    return [], solver.grid
+                if not solver.state_invalid:
+                    expanded.append((path + [actions], solver.cgrid.cells[:]))
+                solver.undo(branch_mark)
+
+            solver.undo(mark)
+        frontier = expanded
+
+    return [cells for (_, cells) in frontier], None
+
+
+def parallel_worker(slab, heuristic, worker_id, queues, free_slots, results, cancel, idle, budget=None):
+    for q in queues + [free_slots]:
+        q.cancel_join_thread()
+
+    heuristic = get_heuristic(heuristic)
+    own = queues[worker_id]
+    victims = [q for k, q in enumerate(queues) if k != worker_id]
+
+    is_idle = False
+    nodes = 0
+    while not cancel.value:
+        slot = take_work(own, victims)
+        if slot is None:
+            if not is_idle:
+                is_idle = True
+                with idle.get_lock():
+                    idle.value += 1
+            continue
+        if is_idle:
+            is_idle = False
+            with idle.get_lock():
+                idle.value -= 1
+
+        cgrid = CandidateGrid.from_cells(slab.size, slab.read(slot))
+        free_slots.put(slot)
+
+        solver = Solver(cgrid, strategies=search_strategies, budget=budget)
+        solver.branch_nodes = nodes
+        solver.solve()
+        solver.enable_trail()
+
+        found = solver.state_solved or \
+            ((not solver.state_invalid) and explore(solver, 0, heuristic, slab, own, free_slots, results,
+                                                    cancel, idle))
+        # The node count carries over from unit to unit for the budget, the stats only get this unit's share
+        unit_stats = SearchStats()
+        unit_stats.add_solver(solver)
+        unit_stats.values['branch_nodes'] -= nodes
+        if found:
+            slab.write(worker_id, solver.cgrid.cells)
+            results.put(('solution', worker_id, unit_stats.to_dict()))
+            break
+        if solver.state_cancelled:
+            results.put(('stopped', None, unit_stats.to_dict()))
+            break
+
+        nodes = solver.branch_nodes
+        results.put(('done', None, unit_stats.to_dict()))
+
+    slab.close()
+
+
+def wait_result(results, processes, budget=None):
+    """
+    Next message the processes put on results, None once the budget is exceeded or one of them exited with
+    an error (crashed or killed) instead of blocking for good. A process exits normally only after its
+    last message is flushed, so that message is still read.
+    """
+    while True:
         try:
-            payload = {'solution': solver.grid, 'duration': 0, 'session': session_id}
-            response_queue.put(payload)
-            print("Solution put into the response queue!")
-        except ValueError:
-            print(f"Error occurred while loading response queue")
-        return
-
-    if not solver.state_invalid:
-        print("Applying multithreaded backtracking..")
-        actions_list = get_next_set_of_actions(solver.grid, step=1)
-
-        with Manager() as manager:
-            solution_found = manager.Event()
-            tracker = manager.dict()
-
-            tracker['total_processes'] = 0
-            tracker['max_processes'] = parallel_processes_max
-            tracker['active_processes'] = 0
-            tracker['pending_processes'] = 0
-            tracker['backtracking_step'] = backtracking_step
-            tracker['backtracking_depth_max'] = backtracking_depth_max
-            tracker['solution'] = None
-
-            tracker['spawn_queue'] = manager.Queue()
-
-            for idx, actions in enumerate(actions_list):
-                tracker['spawn_queue'].put((deepcopy(solver.grid), actions, 1, f'{idx}'))
-
-            with Pool(processes=parallel_processes_max) as pool:
-
-                tracker['active_processes'] += 1
-                tracker['total_processes'] += 1
-                tracker['pending_processes'] = tracker['spawn_queue'].qsize() - 1
-                async_results = [pool.apply_async(worker_process, args=(*tracker['spawn_queue'].get(),
-                                                                        solution_found, tracker, True))]
-
-                while not solution_found.is_set() and any(not result.ready() for result in async_results):
-                    tracker['active_processes'] = sum(1 for result in async_results if not result.ready())
-
-                    batch = []
-                    while (not tracker['spawn_queue'].empty()) and (len(batch) < parallel_processes_max):
-                        batch.append(tracker['spawn_queue'].get())
-
-                    tracker['active_processes'] += len(batch)
-                    tracker['total_processes'] += len(batch)
-                    tracker['pending_processes'] = tracker['spawn_queue'].qsize()
-
-                    for x in batch:
-                        async_results.append(pool.apply_async(worker_process,
-                                                              args=(*x, solution_found, tracker, True)))
-
-            if solution_found.is_set():
-                payload = {'solution': tracker['solution'],
-                           'duration': (datetime.now() - stt_time).total_seconds(),
-                           'session': session_id}
-                response_queue.put(payload)
-                print("Solution put into the response queue!")
-            else:
-                print("Could not find solution!!")
-                try:
-                    payload = {'solution': None,
-                               'duration': (datetime.now() - stt_time).total_seconds(),
-                               'session': session_id}
-                    response_queue.put(payload)
-                    print("Solution put into the response queue!")
-                except ValueError:
-                    print(f"Error occurred while loading response queue")
+            return results.get(timeout=result_poll_interval)
+        except Empty:
+            pass
+        if (budget is not None) and budget.exceeded():
+            logger.debug("Search stopped, budget exceeded or request cancelled")
+            return None
+        for p in processes:
+            if p.exitcode not in (None, 0):
+                logger.error("Solver process %s exited with code %s", p.pid, p.exitcode)
+                return None
+
+
+def take_work(own, victims):
+    try:
+        return own.get(timeout=0.005)
+    except Empty:
+        pass
 
-    else:
+    for q in sample(victims, len(victims)):
         try:
-            payload = {'solution': None,
-                       'duration': (datetime.now() - stt_time).total_seconds(),
-                       'session': session_id}
-            response_queue.put(payload)
-            print("Response put into response queue!")
-        except ValueError:
-            print(f"Error occurred while loading response queue")
-
-
-def worker_process(grid, actions, depth, pcs_id, solution_found, tracker, spawned):
-
-    if solution_found.is_set():
-        if spawned:
-            # print("Solution already found, spawn denied!!")
-            # print(f"Terminating {pcs_id}")
-            printstats(tracker)
-        return None
+            return q.get_nowait()
+        except Empty:
+            pass
+    return None
 
-    if depth > tracker['backtracking_depth_max']:
-        print(f"Depth exceeded, Killing branch {pcs_id}..")
-        # tracker['promising_states'].put(deepcopy(grid), actions)
-        if spawned:
-            # print(f"Terminating {pcs_id}")
-            printstats(tracker)
-        return None
 
-    if spawned:
-        printstats(tracker)
+def explore(solver, depth, heuristic, slab, own, free_slots, results, cancel, idle):
+    """ Trail based depth first search of one work unit, sharing untried siblings while other workers are idle """
+    branches = get_next_set_of_actions(solver.cgrid, step=backtracking_step, heuristic=heuristic)
 
-    solver = Solver(deepcopy(grid), actions)
-    solver.solve()
+    if depth >= solver.max_depth:
+        solver.max_depth = depth + 1
 
-    if solver.state_solved:
-        solution_found.set()
-        tracker['solution'] = solver.grid
-        if spawned:
-            # print(f"Terminating {pcs_id}")
-            printstats(tracker)
-            # print("Solution Found!")
-        return
-
-    if not solver.state_invalid:
-        actions_list = get_next_set_of_actions(solver.grid, step=tracker['backtracking_step'])
-
-        available_spawns = tracker['max_processes'] - tracker['active_processes']
-
-        # if available_spawns > 0:
-        #     print("Sleeping")
-        #     time.sleep(0.1)
-        #     try:
-        #         available_spawns_after = tracker['max_processes'] - tracker['active_processes_queue'].qsize()
-        #     except NotImplementedError:
-        #         available_spawns_after = tracker['max_processes']
-
-        if tracker['spawn_queue'].empty() and (available_spawns > 0):
-            spawn_actions = []
-            while (available_spawns > 0) and (len(actions_list) > 0):
-                spawn_actions.append(actions_list.pop())
-                available_spawns -= 1
-
-            for idx, actions in enumerate(spawn_actions):
-                tracker['spawn_queue'].put((deepcopy(solver.grid), actions, depth+1, f'{pcs_id}.{idx}'))
-
-        for actions in actions_list:
-            worker_process(deepcopy(solver.grid), actions, depth+1, pcs_id, solution_found, tracker, False)
-
-    if spawned:
-        # print(f"Terminating {pcs_id}")
-        printstats(tracker)
+    k = 0
+    while k < len(branches):
+        if cancel.value:
+            return False
 
-    return None
+        if idle.value > 0 and len(branches) - k > 1 and \
+                donate(solver, branches[k + 1:], slab, own, free_slots, results):
+            branches = branches[:k + 1]
 
+        actions = branches[k]
+        k += 1
 
-def printstats(tracker):
-    print({
-        'Total': tracker['total_processes'],
-        'Active': tracker['active_processes'],
-        'Pending': tracker['pending_processes'],
-        'backtracking_depth_max': tracker['backtracking_depth_max']
-    })
+        mark = solver.mark()
+        solver.apply_branch(actions)
 
+        if solver.state_cancelled:
+            return False
+        if solver.state_solved:
+            return True
 
-def sat_solver(puzzle, response_queue, session_id):
+        if (not solver.state_invalid) and (depth < max(backtracking_depth_max, solver.size * solver.size)):
+            if explore(solver, depth + 1, heuristic, slab, own, free_slots, results, cancel, idle):
+                return True
+
+        solver.undo(mark)
+
+    return False
+
+
+def donate(solver, branches, slab, own, free_slots, results):
+    """
+    Hand the given sibling branches over as one work unit: the current grid with the branching cell
+    restricted to their values. Returns False (and keeps the branches) when no slot is free.
+    """
+    try:
+        slot = free_slots.get_nowait()
+    except Empty:
+        return False
+
+    cells = solver.cgrid.cells[:]
+    for action in branches[0]:
+        (i, j) = action['idx']
+        cells[i * solver.size + j] = 0
+    for actions in branches:
+        for action in actions:
+            (i, j) = action['idx']
+            cells[i * solver.size + j] |= 1 << (action['val'] - 1)
+
+    slab.write(slot, cells)
+    results.put(('spawned', 1, None))
+    own.put(slot)
+    return True
+
+
+def sat_solver(puzzle, response_queue, session_id, encoding='naive', amo='pairwise', budget=None):
     stt_time = datetime.now()
-    print("")
-    print("SAT Solver invoked!")
-    solver = SATSolver(puzzle)
-    solution = solver.solve()
+    stats = SearchStats('SAT')
+    logger.debug("SAT Solver invoked!")
+    with stats.phase('encoding'):
+        if encoding == 'compact':
+            solver = SATSolver(puzzle, encoding=encoding, amo=amo)
+        else:
+            solver = get_warm_solver(puzzle)
+    with stats.phase('search'):
+        solution = solver.solve(puzzle, budget=budget)
+    stats.add_sat(solver)
 
     payload = {'solution': solution,
                'duration': (datetime.now() - stt_time).total_seconds(),
-               'session': session_id}
+               'session': session_id,
+               'stats': stats.to_dict()}
     try:
         response_queue.put(payload)
         del solver
     except ValueError:
         del solver
-        print(f"Error occurred while loading response queue")
+        logger.error("Error occurred while loading response queue")
+
+
+def dlx_solver(puzzle, response_queue, session_id, budget=None):
+    stt_time = datetime.now()
+    stats = SearchStats('DLX')
+    logger.debug("DLX Solver invoked!")
+    with stats.phase('propagation'):
+        solver = simple_solve(puzzle)
+    stats.add_solver(solver)
+
+    solution = None
+    if solver.state_solved:
+        solution = solver.grid
+    elif not solver.state_invalid:
+        # Propagation keeps every solution, the exact cover search only runs over what is left
+        with stats.phase('encoding'):
+            dlx = DLXSolver(puzzle, solver.cgrid, budget=budget)
+        with stats.phase('search'):
+            solution = dlx.solve()
+        stats.add_dlx(dlx)
+
+    if solution is None:
+        logger.debug("Could not find solution!!")
+
+    payload = {'solution': solution,
+               'duration': (datetime.now() - stt_time).total_seconds(),
+               'session': session_id,
+               'stats': stats.to_dict()}
+    try:
+        response_queue.put(payload)
+    except ValueError:
+        logger.error("Error occurred while loading response queue")
+
+
+def auto_solver(puzzle, response_queue, session_id, heuristic=default_heuristic, budget=None, thresholds=None,
+                race=True):
+    """
+    Propagate first, then let the portfolio pick: finish with backtracking, or race backtracking against SAT
+    and take the first answer. The payload names the winning engine and carries what the portfolio needs to
+    learn from it. Without race (e.g. inside a daemonic pool worker) SAT runs alone instead of the race.
+    """
+    stt_time = datetime.now()
+    stats = SearchStats('auto')
+    logger.debug("Auto Solver invoked!")
+    portfolio = Portfolio(thresholds)
+    with stats.phase('propagation'):
+        solver = simple_solve(puzzle)
+    stats.add_solver(solver)
+    score = portfolio.difficulty(solver.cgrid)
+
+    plan = 'propagation'
+    solution, engine = None, None
+    if solver.state_solved:
+        solution, engine = solver.grid, 'propagation'
+    elif not solver.state_invalid:
+        plan = portfolio.choose(solver.size, score)
+        with stats.phase('search'):
+            if plan == 'backtracking':
+                solver = apply_backtracking(solver.cgrid, heuristic=heuristic, budget=budget)
+                stats.add_solver(solver)
+                solution = solver.grid if solver.state_solved else None
+                engine = 'backtracking'
+            elif race:
+                solution, engine = race_engines(puzzle, solver.cgrid, heuristic, budget, stats)
+            else:
+                sat = SATSolver(puzzle, encoding='compact')
+                solution, engine = sat.solve(budget=budget), 'SAT'
+                stats.add_sat(sat)
+        logger.debug("Plan %s (score %s), answered by %s", plan, score, engine)
+
+    payload = {'solution': solution,
+               'duration': (datetime.now() - stt_time).total_seconds(),
+               'session': session_id,
+               'engine': engine,
+               'auto': {'size': solver.size, 'score': score, 'plan': plan},
+               'stats': stats.to_dict()}
+    try:
+        response_queue.put(payload)
+    except ValueError:
+        logger.error("Error occurred while loading response queue")
+
+
+def race_engines(puzzle, cgrid, heuristic, budget=None, stats=None):
+    """
+    Backtracking (in this process) against SAT (in a child process) on a propagated grid. Whichever engine
+    finishes first raises the shared race flag, which stops the other one through its budget.
+    Returns the solution (or None) and the name of the engine that decided. The counters of both engines
+    are added to stats when given.
+    """
+    race_flags = RawArray('b', 1)
+    race_budget = Budget(flags=race_flags, parent=budget)
+    results = Queue()
+
+    p = Process(target=sat_engine, args=(puzzle, results, race_budget), daemon=True)
+    p.start()
+
+    solver = apply_backtracking(cgrid, heuristic=heuristic, budget=race_budget)
+    if stats is not None:
+        stats.add_solver(solver)
+    if not solver.state_cancelled:
+        # Solved or proven unsolvable, either way the race is decided
+        race_flags[0] = 1
+        solution, engine = (solver.grid if solver.state_solved else None), 'backtracking'
+    else:
+        # The race flag set by SAT exceeds race_budget, so only the request budget bounds the wait
+        (solution, sat_stats) = wait_result(results, [p], budget) or (None, None)
+        engine = 'SAT'
+        if stats is not None and sat_stats is not None:
+            stats.add(sat_stats)
+
+    p.join(timeout=1)
+    if p.is_alive():
+        p.terminate()
+    return solution, engine
+
+
+def sat_engine(puzzle, results, budget):
+    solution, stats = None, None
+    try:
+        solver = SATSolver(puzzle, encoding='compact')
+        solution = solver.solve(budget=budget)
+        stats = SearchStats('SAT')
+        stats.add_sat(solver)
+        stats = stats.to_dict()
+        if not solver.state_cancelled:
+            budget.flags[budget.slot] = 1
+    finally:
+        results.put((solution, stats))
+
+
+def run_solver(puzzle, response_queue, session_id, solver='sequential', heuristic=default_heuristic,
+               encoding='naive', amo='pairwise', budget=None, thresholds=None, race=True, profile=False,
+               output=None):
+    """
+    Run the solver selected by name (as in a request message), the payload goes to response_queue.
+    thresholds and race only apply to the 'auto' mode. With profile the solver runs under cProfile and the
+    payload gets a 'profile' report (see Profiling.profile_solver). output tags the payload with the wire
+    format its solution is sent in (see WireFormat.encode_payload), the solution itself stays in the
+    list-of-lists format for the solution cache
+    """
+    if output not in (None, 'lists'):
+        results = LocalQueue()
+        run_solver(puzzle, results, session_id, solver, heuristic, encoding, amo, budget, thresholds, race, profile)
+        payload = results.get()
+        payload['format'] = output
+        response_queue.put(payload)
+    elif profile:
+        profile_solver(run_solver, puzzle, response_queue, session_id, solver, heuristic, encoding, amo, budget,
+                       thresholds, race)
+    elif solver == 'auto':
+        auto_solver(puzzle, response_queue, session_id, heuristic, budget, thresholds, race)
+    elif solver == 'SAT':
+        sat_solver(puzzle, response_queue, session_id, encoding, amo, budget)
+    elif solver == 'parallel':
+        parallel_solver(puzzle, response_queue, session_id, heuristic, budget)
+    elif solver == 'DLX':
+        dlx_solver(puzzle, response_queue, session_id, budget)
+    else:
+        sequential_solver(puzzle, response_queue, session_id, heuristic, budget)
+
+
+def init_batch_worker(cancel_flags):
+    """ Pool initializer, the batch jobs check the cancel flags (CancelTable.flags) of their slot """
+    global batch_cancel_flags
+    batch_cancel_flags = cancel_flags
+
+
+def batch_budget(timeout, max_nodes, slot):
+    """ Budget of a batch job, cancelled through slot when the worker was started with the cancel flags """
+    if (slot is not None) and (batch_cancel_flags is not None):
+        return Budget.from_timeout(timeout, max_nodes, batch_cancel_flags, slot)
+    if (timeout is not None) or (max_nodes is not None):
+        return Budget.from_timeout(timeout, max_nodes)
+    return None
+
+
+def batch_solve(job):
+    """
+    Solve one puzzle of a batch inside a pool worker and return its payload, the session field holds the
+    index of the puzzle in the batch. The worker is already one of many (and cannot start processes), so
+    'parallel' runs sequentially and 'auto' does not race. slot is the cancel slot of the batch, or None.
+    """
+    (index, puzzle, solver, heuristic, encoding, amo, timeout, max_nodes, thresholds, slot) = job
+    if solver == 'parallel':
+        solver = 'sequential'
+
+    budget = batch_budget(timeout, max_nodes, slot)
+
+    results = LocalQueue()
+    run_solver(puzzle, results, index, solver, heuristic, encoding, amo, budget, thresholds, race=False)
+    return results.get()
+
+
+def batch_count(job):
+    """ count_solutions of one puzzle inside a pool worker, the job carries the limits instead of a Budget """
+    (puzzle, limit, solver, heuristic, encoding, amo, timeout, max_nodes, thresholds, slot) = job
+
+    budget = batch_budget(timeout, max_nodes, slot)
+    return count_solutions(puzzle, limit, solver, heuristic, encoding, amo, budget, thresholds)
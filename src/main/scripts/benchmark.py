@@ -0,0 +1,256 @@
+# Benchmark of the solving engines over fixed puzzle corpora, compared against a saved baseline
+#
+#   python benchmark.py                    run every engine on every corpus, compare with the baseline
+#   python benchmark.py --save-baseline    store this run as the new baseline
+#   python benchmark.py --build-corpus     generate the corpora again (fixed seeds, so they come out the same)
+#
+# Exits with 1 when a result regressed against the baseline by more than the tolerance.
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from multiprocessing import Process, Queue, cpu_count
+from queue import SimpleQueue
+
+from pulsar.tools import simple_solve, apply_backtracking, parallel_solver, default_heuristic
+from pulsar.SATSolver import get_warm_solver
+from pulsar.DLXSolver import DLXSolver
+from pulsar.Budget import Budget
+from pulsar.Generator import generate, difficulty_levels
+from pulsar.SolutionCache import is_solution_of
+
+
+benchmark_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+baseline_file = os.path.join(benchmark_dir, 'baseline.json')
+
+corpus_sizes = (9, 16, 25)
+corpus_seed = 2024
+# Puzzles per difficulty level, and the clue count each level is dug to (None for minimal puzzles)
+corpus_per_level = {9: 10, 16: 5, 25: 3}
+corpus_clues = {
+    9: {'easy': 32, 'medium': None, 'hard': None, 'expert': None},
+    16: {'easy': 140, 'medium': 120, 'hard': 105, 'expert': None},
+    25: {'easy': 400, 'medium': 330, 'hard': 315, 'expert': 305},
+}
+# Seeds tried per level, some levels are rare at some clue counts
+corpus_tries = {9: 400, 16: 40, 25: 12}
+
+engine_names = ('simple_solve', 'backtracking', 'parallel', 'SAT', 'DLX')
+puzzle_timeout = 30
+# Relative change of a latency, throughput or memory figure reported as a regression
+regression_tolerance = 0.25
+# Latencies must also grow by this much to count, sub millisecond timings are mostly noise
+regression_floor_ms = 1.0
+
+
+def corpus_file(size):
+    return os.path.join(benchmark_dir, f'corpus_{size}.json')
+
+
+def build_corpus(size):
+    """ Puzzles with a unique solution for every difficulty level of the size, from fixed seeds """
+    corpus = {'size': size, 'seed': corpus_seed, 'puzzles': []}
+    for level in difficulty_levels:
+        found, seed = 0, corpus_seed
+        while found < corpus_per_level[size] and seed < corpus_seed + corpus_tries[size]:
+            result = generate(size, corpus_clues[size][level], difficulty=level, seed=seed, attempts=1)
+            seed += 1
+            if result is not None:
+                corpus['puzzles'].append({'level': level, 'clues': result['clues'], 'puzzle': result['puzzle']})
+                found += 1
+        print(f"{size}x{size} {level}: {found} puzzles")
+    return corpus
+
+
+def load_corpus(size):
+    with open(corpus_file(size)) as f:
+        return json.load(f)['puzzles']
+
+
+# Every engine takes the puzzle and a Budget, and returns (solution or None, nodes explored or None)
+def run_simple_solve(puzzle, budget):
+    solver = simple_solve(puzzle)
+    return (solver.grid if solver.state_solved else None), None
+
+
+def run_backtracking(puzzle, budget):
+    solver = simple_solve(puzzle)
+    if (not solver.state_solved) and (not solver.state_invalid):
+        solver = apply_backtracking(solver.cgrid, heuristic=default_heuristic, budget=budget)
+    return (solver.grid if solver.state_solved else None), solver.branch_nodes
+
+
+def run_parallel(puzzle, budget):
+    results = SimpleQueue()
+    parallel_solver(puzzle, results, 0, budget=budget)
+    return results.get()['solution'], None
+
+
+def run_sat(puzzle, budget):
+    solver = get_warm_solver(puzzle)
+    solution = solver.solve(puzzle, budget=budget)
+    return solution, solver.decisions
+
+
+def run_dlx(puzzle, budget):
+    solver = simple_solve(puzzle)
+    if solver.state_solved or solver.state_invalid:
+        return (solver.grid if solver.state_solved else None), 0
+    dlx = DLXSolver(puzzle, solver.cgrid, budget=budget)
+    return dlx.solve(), dlx.nodes_explored
+
+
+engines = {
+    'simple_solve': run_simple_solve,
+    'backtracking': run_backtracking,
+    'parallel': run_parallel,
+    'SAT': run_sat,
+    'DLX': run_dlx,
+}
+
+
+def percentile(values, q):
+    """ Nearest rank percentile of a non empty list """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples):
+    latencies = [ms for (ms, _, _) in samples]
+    nodes = [n for (_, _, n) in samples if n is not None]
+    return {'puzzles': len(samples),
+            'solved': sum(1 for (_, solved, _) in samples if solved),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'nodes_mean': round(sum(nodes) / len(nodes), 1) if nodes else None,
+            'puzzles_per_second': round(len(latencies) / (sum(latencies) / 1000), 2) if sum(latencies) else None}
+
+
+def run_cell(engine, size, puzzles, timeout, results):
+    """ One engine over one corpus, in its own process so that the peak RSS belongs to this run alone """
+    run = engines[engine]
+    samples = {}
+    with redirect_stdout(io.StringIO()):
+        if engine == 'SAT':
+            # The warm solver (and its encoding) is built once per process, as in the worker pool
+            get_warm_solver(puzzles[0]['puzzle'])
+
+        for entry in puzzles:
+            puzzle = entry['puzzle']
+            start = time.perf_counter()
+            solution, nodes = run(puzzle, Budget.from_timeout(timeout))
+            elapsed = (time.perf_counter() - start) * 1000
+            samples.setdefault(entry['level'], []).append((elapsed, is_solution_of(puzzle, solution), nodes))
+
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    report = {level: summarize(level_samples) for level, level_samples in samples.items()}
+    report['all'] = summarize([sample for level_samples in samples.values() for sample in level_samples])
+    report['all']['peak_rss_mb'] = round(peak_kb / 1024, 1)
+    results.put(report)
+
+
+def run_benchmark(sizes, engine_list, timeout):
+    report = {'created': datetime.now().isoformat(timespec='seconds'),
+              'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                          'cpus': cpu_count()},
+              'timeout': timeout,
+              'results': {}}
+    for size in sizes:
+        puzzles = load_corpus(size)
+        for engine in engine_list:
+            results = Queue()
+            p = Process(target=run_cell, args=(engine, size, puzzles, timeout, results))
+            p.start()
+            cell = results.get()
+            p.join()
+            for level, metrics in cell.items():
+                report['results'][f'{engine}/{size}/{level}'] = metrics
+            print_row(f'{engine}/{size}/all', cell['all'])
+    return report
+
+
+def print_row(key, metrics, notes=''):
+    print(f"{key:28} solved {metrics['solved']:3}/{metrics['puzzles']:<3} p50 {metrics['p50_ms']:10.2f} ms  "
+          f"p95 {metrics['p95_ms']:10.2f} ms  p99 {metrics['p99_ms']:10.2f} ms  "
+          f"{metrics['puzzles_per_second'] or 0:9.2f}/s  nodes {metrics['nodes_mean']}  "
+          f"rss {metrics.get('peak_rss_mb', '-')} MB {notes}")
+
+
+def compare(report, baseline, tolerance):
+    """ Regressions of the report against the baseline, as readable lines """
+    regressions = []
+    for key, metrics in report['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        if metrics['solved'] < base['solved']:
+            regressions.append(f"{key}: solved {metrics['solved']} < {base['solved']}")
+        for figure in ('p50_ms', 'p95_ms', 'peak_rss_mb'):
+            value, base_value = metrics.get(figure), base.get(figure)
+            if not (value and base_value) or value <= base_value * (1 + tolerance):
+                continue
+            if figure.endswith('_ms') and value - base_value < regression_floor_ms:
+                continue
+            regressions.append(f"{key}: {figure} {value} > {base_value}")
+        rate, base_rate = metrics['puzzles_per_second'], base['puzzles_per_second']
+        if rate and base_rate and rate < base_rate / (1 + tolerance):
+            regressions.append(f"{key}: puzzles_per_second {rate} < {base_rate}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Pulsar engines against a saved baseline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(corpus_sizes))
+    parser.add_argument('--engines', nargs='+', default=list(engine_names), choices=engine_names)
+    parser.add_argument('--timeout', type=float, default=puzzle_timeout, help="seconds per puzzle")
+    parser.add_argument('--baseline', default=baseline_file)
+    parser.add_argument('--tolerance', type=float, default=regression_tolerance)
+    parser.add_argument('--output', help="write the report of this run to a JSON file")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--build-corpus', action='store_true')
+    args = parser.parse_args()
+
+    if args.build_corpus:
+        os.makedirs(benchmark_dir, exist_ok=True)
+        for size in args.sizes:
+            corpus = build_corpus(size)
+            with open(corpus_file(size), 'w') as f:
+                f.write('{"size": %d, "seed": %d, "puzzles": [\n' % (corpus['size'], corpus['seed']))
+                f.write(',\n'.join(json.dumps(entry) for entry in corpus['puzzles']))
+                f.write('\n]}\n')
+        return 0
+
+    report = run_benchmark(args.sizes, args.engines, args.timeout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, save one with --save-baseline")
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(report, json.load(f), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    print(f"{len(regressions)} regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+# Solve a file of puzzles (or stdin) on a process pool, streaming one NDJSON line per puzzle
+#
+#   python bulk_solve.py puzzles.txt -o solutions.ndjson      one puzzle per line, in input order
+#   cat puzzles.ndjson | python bulk_solve.py --unordered      stdin, results as they complete
+#   python bulk_solve.py puzzles.txt --offset 1000000         resume after the first million lines
+#
+# An input line is a plain puzzle string (or base64 with --format binary), a JSON list of rows, or a JSON
+# object {"puzzle": ..., "format": ..., "id": ...}. Blank lines and lines starting with '#' are skipped but
+# still counted, every output line carries the number of its input line ("line", from 0):
+#
+#   {"line": 0, "id": ..., "solution": "...", "duration": ..., "stats": {...}}
+#   {"line": 1, "error": "..."}
+#
+# To resume a run, pass the first input line missing from its output as --offset. Files are memory mapped
+# and read line by line, and at most inflight_per_process chunks of lines per process are held at once, so
+# the memory used does not grow with the size of the input.
+import argparse
+import json
+import mmap
+import sys
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from queue import SimpleQueue
+
+from pulsar.tools import batch_solve, default_heuristic
+from pulsar.heuristics import branching_heuristics
+from pulsar.SATSolver import amo_encodings
+from pulsar.WireFormat import wire_formats, check_format, decode_puzzle, encode_solution, to_base64
+
+
+solvers = ('sequential', 'parallel', 'SAT', 'DLX', 'auto')
+chunk_lines = 256
+# Chunks submitted to the pool ahead of the output, per process
+inflight_per_process = 2
+# Bytes scanned at a time when skipping to the offset
+skip_block = 1 << 20
+
+
+def read_lines(path, offset=0):
+    """ (line number, bytes) of the input from line offset on; a file is memory mapped, '-' reads stdin """
+    if path == '-':
+        for number, line in enumerate(sys.stdin.buffer):
+            if number >= offset:
+                yield number, line
+        return
+
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file, which cannot be mapped
+            return
+        with mm:
+            mm.seek(skip_lines(mm, offset))
+            for number, line in enumerate(iter(mm.readline, b''), offset):
+                yield number, line
+
+
+def skip_lines(mm, count):
+    """ Byte position of line count of a mapped file, newlines are counted a block at a time """
+    position = 0
+    while count > 0 and position < len(mm):
+        block = mm[position:position + skip_block]
+        newlines = block.count(b'\n')
+        if newlines < count:
+            count -= newlines
+            position += len(block)
+            continue
+        for _ in range(count):
+            position = mm.find(b'\n', position) + 1
+        count = 0
+    return position
+
+
+def chunked(lines, size):
+    chunk = []
+    for entry in lines:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_line(line, fmt):
+    """ (puzzle in the list-of-lists format, id) of an input line, None for lines to skip """
+    text = line.strip()
+    if not text or text.startswith(b'#'):
+        return None
+    if text.startswith(b'{'):
+        entry = json.loads(text)
+        return decode_puzzle(entry['puzzle'], entry.get('format', 'lists')), entry.get('id')
+    if text.startswith(b'['):
+        return decode_puzzle(json.loads(text), 'lists'), None
+    return decode_puzzle(text.decode('ascii'), fmt), None
+
+
+def solve_chunk(chunk, options):
+    """ Output records of a chunk of input lines, run inside a pool worker """
+    records = []
+    for (number, line) in chunk:
+        try:
+            parsed = parse_line(line, options['format'])
+        except (ValueError, TypeError, KeyError) as e:
+            records.append({'line': number, 'error': f"Invalid puzzle: {e}"})
+            continue
+        if parsed is None:
+            continue
+
+        (puzzle, puzzle_id) = parsed
+        try:
+            check_format(options['output'], len(puzzle))
+        except ValueError as e:
+            records.append({'line': number, 'error': str(e)})
+            continue
+
+        payload = batch_solve((number, puzzle, options['solver'], options['heuristic'], options['encoding'],
+                               options['amo'], options['timeout'], options['max_nodes'], None, None))
+        solution = encode_solution(payload['solution'], options['output'])
+        if options['output'] == 'binary' and solution is not None:
+            solution = to_base64(solution)
+
+        record = {'line': number}
+        if puzzle_id is not None:
+            record['id'] = puzzle_id
+        record.update(solution=solution, duration=payload['duration'])
+        if options['stats']:
+            record['stats'] = payload['stats']
+        records.append(record)
+    return records
+
+
+def solve_stream(lines, options, processes, chunksize=chunk_lines, ordered=True):
+    """
+    Generator of the output records of the input lines, solved chunk by chunk on a pool of processes. At
+    most inflight_per_process chunks per process are submitted ahead of the output. Records come in input
+    order, or chunk by chunk as they complete unless ordered.
+    """
+    pool = Pool(processes)
+    window = deque()
+    done = SimpleQueue()
+
+    def next_records():
+        result = window.popleft()
+        if ordered:
+            return result.get()
+        records = done.get()
+        if isinstance(records, BaseException):
+            raise records
+        return records
+
+    try:
+        for chunk in chunked(lines, chunksize):
+            callback = None if ordered else done.put
+            window.append(pool.apply_async(solve_chunk, (chunk, options), callback=callback,
+                                           error_callback=callback))
+            if len(window) >= inflight_per_process * processes:
+                yield from next_records()
+        while window:
+            yield from next_records()
+    finally:
+        pool.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve a file of puzzles, one NDJSON result line per puzzle")
+    parser.add_argument('input', nargs='?', default='-', help="puzzle file, '-' (default) reads stdin")
+    parser.add_argument('-o', '--out', help="output file (default stdout), appended to with --offset")
+    parser.add_argument('--format', default='string', choices=wire_formats,
+                        help="format of plain lines that are not JSON")
+    parser.add_argument('--solution-format', default='string', choices=wire_formats)
+    parser.add_argument('--solver', default='sequential', choices=solvers)
+    parser.add_argument('--heuristic', default=default_heuristic,
+                        choices=sorted(branching_heuristics) + ['legacy'])
+    parser.add_argument('--encoding', default='naive', choices=('naive', 'compact'))
+    parser.add_argument('--amo', default='pairwise', choices=amo_encodings)
+    parser.add_argument('--timeout', type=float, help="seconds per puzzle")
+    parser.add_argument('--max-nodes', type=int, help="search nodes per puzzle")
+    parser.add_argument('--processes', type=int, default=cpu_count())
+    parser.add_argument('--chunksize', type=int, default=chunk_lines, help="input lines per task")
+    parser.add_argument('--offset', type=int, default=0, help="input lines to skip, to resume an earlier run")
+    parser.add_argument('--unordered', action='store_true', help="write results as they complete")
+    parser.add_argument('--no-stats', action='store_true', help="leave the search statistics out")
+    args = parser.parse_args()
+
+    options = {'format': args.format, 'output': args.solution_format, 'solver': args.solver,
+               'heuristic': args.heuristic, 'encoding': args.encoding, 'amo': args.amo, 'timeout': args.timeout,
+               'max_nodes': args.max_nodes, 'stats': not args.no_stats}
+
+    out = open(args.out, 'a' if args.offset else 'w') if args.out else sys.stdout
+    solved = failed = 0
+    try:
+        for record in solve_stream(read_lines(args.input, args.offset), options, args.processes,
+                                   args.chunksize, not args.unordered):
+            if record.get('solution') is not None:
+                solved += 1
+            else:
+                failed += 1
+            out.write(json.dumps(record) + '\n')
+    finally:
+        out.flush()
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"{solved} solved, {failed} without solution", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,8 @@
+import logging
+
 from pulsar.Pulsar import Pulsar
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
     pulsar = Pulsar()
     pulsar.run()
@@ -0,0 +1,27 @@
+# A request released early must not free the flagged slot of a cancelled request that is still running
+from pulsar.Budget import Budget, CancelTable
+
+
+table = CancelTable(2)
+slot_a = table.acquire('X', 'a')
+table.cancel('X')
+slot_b = table.acquire('X', 'b')
+table.release('b')
+slot_y = table.acquire('Y', 'y')
+
+errors = []
+if slot_a == slot_b:
+    errors.append("request after the cancel got the cancelled slot")
+if not Budget(flags=table.flags, slot=slot_a).cancelled():
+    errors.append("cancelled request lost its cancellation")
+if slot_y != slot_b:
+    errors.append("slot of the released request was not freed")
+table.release('a')
+table.release('y')
+if table.sessions or len(table.free) != 2:
+    errors.append(f"slots left behind: {table.sessions}")
+
+if errors:
+    print("Invalid: " + "; ".join(errors))
+else:
+    print("Valid")
@@ -0,0 +1,28 @@
+# A node budget of one request must not carry over to the next request on the same warm SAT solver
+import json
+import os
+
+from pulsar.SATSolver import get_warm_solver
+from pulsar.SolutionCache import is_solution_of
+from pulsar.Budget import Budget
+
+
+corpus_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'corpus_16.json')
+with open(corpus_file) as f:
+    puzzles = [entry['puzzle'] for entry in json.load(f)['puzzles'] if entry['level'] in ('hard', 'expert')]
+
+solver = get_warm_solver(puzzles[0])
+solution = solver.solve(puzzles[0], budget=Budget.from_timeout(10, max_nodes=1))
+print(f"Budgeted request: cancelled = {solver.state_cancelled}")
+
+failed = 0
+for puzzle in puzzles:
+    solver = get_warm_solver(puzzle)
+    solution = solver.solve(puzzle, budget=Budget.from_timeout(10))
+    if solver.state_cancelled or not is_solution_of(puzzle, solution):
+        failed += 1
+
+if failed:
+    print(f"Invalid: {failed} of {len(puzzles)} later requests without a node budget were not solved")
+else:
+    print("Valid")
@@ -1,4 +1,4 @@
-from pulsar.tools import simple_solve, apply_backtracking, sequential_solver
+from pulsar.tools import simple_solve, apply_backtracking
 from copy import deepcopy
 from pulsar.Solver import Solver
 
@@ -59,7 +59,7 @@ def puzzle_valid(grid):
     return True
 
 
-solver = sequential_solver(test_puzzle_rank_4)
+solver = simple_solve(test_puzzle_rank_4)
 
 if solver.state_invalid:
     print("Invalid puzzle!")